@@ -4,5 +4,21 @@ __version__ = '1.3.0'
 
 from .data import *
 from .visualization import draw
-from .inference import infer_identity_edges, infer_jaccard_identity, infer_identities
+from .inference import infer_identity_edges, infer_jaccard_identity, infer_identities, get_candidate_pairs, most_probable_couplings, get_weighted_neighbors, infer_component, get_components, get_union_find, component_upper_bound, find_supernodes, get_supernode_weights, get_node_index, resolve_device, resolve_identity
+from .ranking import top_predictions
+from .incremental import IncrementalResolver
+from .unionfind import UnionFind
+from .compact import CompactGraph
+from .sparse import graph_to_incidence, sparse_jaccard, pair_jaccard, infer_sparse_identities
+from .similarity import get_kernel, component_similarities, jaccard_kernel, adamic_adar_kernel, resource_allocation_kernel, label_weighted_kernel
+from .cache import ComponentCache, component_fingerprint
+from .checkpoint import Checkpoint
+from .candidates import CandidateTable, build_candidate_table
+from .instrumentation import Instrumentation, instrumentation, get_report, add_hook, remove_hook, set_quiet
+from .lsh import minhash_signatures, lsh_candidate_pairs, minhash_jaccard, infer_minhash_identities, minhash_report
+from .outofcore import infer_out_of_core, node_code
+from .sharding import write_shards, run_worker, merge_shards, release_stale_claims, wait_for_shards, infer_sharded_identities
+from .service import ResolutionService, serve
+from .predictionindex import PredictionIndex, write_prediction_index
+from .evaluation import get_truth_pairs, evaluate_predictions, evaluate_variants, pareto_front
 from .solutions import *
\ No newline at end of file
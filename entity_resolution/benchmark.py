@@ -0,0 +1,152 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from .data import create_synthetic_graph, graph_to_raw, raw_to_entities_json, entities_json_to_graph
+from .inference import infer_identities, infer_jaccard_identity
+from .solutions import inference_to_frame
+
+default_scales = (1000, 10000, 100000)
+"""The device counts of the benchmark graphs, larger scales can be passed explicitly."""
+
+pipeline_steps = ("raw_to_entities_json", "entities_json_to_graph", "infer_identities", "infer_jaccard_identity", "inference_to_frame")
+"""The measured functions, in pipeline order."""
+
+
+def __max_rss():
+    """
+    Returns the peak resident set size of the process in bytes.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def measure(step, devices, trace_memory, f, *args, **kwargs):
+    """
+    Calls the given function and measures its wall time and memory.
+    The time is measured without tracemalloc, which slows the step down, so the memory is traced in a second call.
+
+    :param step: the name of the step
+    :param devices: the amount of devices of the benchmark graph
+    :param trace_memory: whether to call the function a second time to measure the peak of the Python allocations with tracemalloc
+    :param f: the function
+    :return: (the result of the first call, a dictionary with the measurements)
+    """
+    t = time.perf_counter()
+    result = f(*args, **kwargs)
+    elapsed = time.perf_counter() - t
+    # a peak of the whole process so far, it never goes down
+    record = {"step": step, "devices": devices, "seconds": round(elapsed, 4), "max_rss_bytes": __max_rss()}
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            f(*args, **kwargs)
+            record["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            # a failing step does not leave the tracing on for the next ones
+            tracemalloc.stop()
+    return result, record
+
+
+def run_benchmarks(scales = default_scales, output_path = None, threshold = 0.1, max_predictions = 100, steps = pipeline_steps, trace_memory = True, lines_per_file = 10000):
+    """
+    Times the pipeline on synthetic graphs of increasing size.
+    At every scale a graph is generated with `create_synthetic_graph` (one identity per five devices) and written in the raw format with `graph_to_raw`,
+    then the raw files go through the measured steps.
+
+    :param scales: the device counts
+    :param output_path: if specified, the results are written there as JSON
+    :param threshold: predictions with a probability below this number will be ignored
+    :param max_predictions: the maximum amount of predictions to generate (top N)
+    :param steps: the steps to measure, see `pipeline_steps`; the steps they depend on always run
+    :param trace_memory: whether to measure the peak of the Python allocations with tracemalloc, in a second call of every step
+    :param lines_per_file: how many lines per raw file
+    :return: a dictionary with the environment and a list of measurements
+    """
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec = "seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "threshold": threshold,
+        "max_predictions": max_predictions,
+        "results": []
+    }
+    for devices in scales:
+        g = create_synthetic_graph(devices, max(devices // 5, 1))
+        with tempfile.TemporaryDirectory() as raw_directory:
+            graph_to_raw(g, raw_directory, lines_per_file)
+            del g
+            entities, record = measure("raw_to_entities_json", devices, trace_memory, raw_to_entities_json, raw_directory)
+            report["results"].append(record)
+        g, record = measure("entities_json_to_graph", devices, trace_memory, entities_json_to_graph, entities)
+        report["results"].append(record)
+        del entities
+        if "infer_identities" in steps or "inference_to_frame" in steps:
+            (inferred, ids), record = measure("infer_identities", devices, trace_memory, infer_identities, g, threshold, True, max_predictions)
+            record["predictions"] = len(inferred)
+            report["results"].append(record)
+            if "inference_to_frame" in steps:
+                frame, record = measure("inference_to_frame", devices, trace_memory, inference_to_frame, ids)
+                report["results"].append(record)
+        if "infer_jaccard_identity" in steps:
+            inferred, record = measure("infer_jaccard_identity", devices, trace_memory, infer_jaccard_identity, g, threshold)
+            record["predictions"] = len(inferred)
+            report["results"].append(record)
+    report["results"] = [r for r in report["results"] if r["step"] in steps]
+    if output_path is not None:
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent = 2)
+        print("Benchmark written to", output_path)
+    return report
+
+
+def compare_benchmarks(baseline, current, tolerance = 0.2):
+    """
+    Compares two benchmark reports and returns the steps which got slower or need more memory.
+
+    :param baseline: a report or the path of a JSON report, see `run_benchmarks`
+    :param current: another report or path
+    :param tolerance: the relative increase which is not considered a regression
+    :return: an array of (step, devices, metric, baseline value, current value) tuples
+    """
+    reports = []
+    for report in [baseline, current]:
+        if isinstance(report, str):
+            with open(report, "r") as f:
+                report = json.load(f)
+        reports.append({(r["step"], r["devices"]): r for r in report["results"]})
+    coll = []
+    for key, before in reports[0].items():
+        after = reports[1].get(key)
+        if after is None:
+            continue
+        for metric in ["seconds", "peak_traced_bytes"]:
+            if metric in before and metric in after and after[metric] > before[metric] * (1 + tolerance):
+                coll.append((key[0], key[1], metric, before[metric], after[metric]))
+    return coll
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Times the entity resolution pipeline on synthetic graphs.")
+    parser.add_argument("--scales", type = int, nargs = "+", default = list(default_scales), help = "the device counts")
+    parser.add_argument("--output", default = os.path.join(os.getcwd(), "benchmark.json"), help = "the JSON report")
+    parser.add_argument("--steps", nargs = "+", default = list(pipeline_steps), choices = pipeline_steps, help = "the steps to measure")
+    parser.add_argument("--threshold", type = float, default = 0.1)
+    parser.add_argument("--max-predictions", type = int, default = 100)
+    parser.add_argument("--no-tracemalloc", action = "store_true", help = "skip the second, traced call of every step")
+    parser.add_argument("--baseline", help = "a previous report, the regressions against it are listed")
+    arguments = parser.parse_args()
+    result = run_benchmarks(arguments.scales, arguments.output, arguments.threshold, arguments.max_predictions, arguments.steps, not arguments.no_tracemalloc)
+    if arguments.baseline is not None:
+        regressions = compare_benchmarks(arguments.baseline, result)
+        for step, devices, metric, before, after in regressions:
+            print(f"Regression in {step} with {devices} devices: {metric} went from {before} to {after}.")
+        sys.exit(1 if len(regressions) > 0 else 0)
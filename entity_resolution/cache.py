@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+
+
+def node_key(g, u):
+    """
+    Returns the (label, id) key of a node, which does not depend on the node numbering of a run.
+
+    :param g: a graph
+    :param u: a node
+    :return: a (label, id) tuple of strings
+    """
+    return g.nodes[u]["label"], str(g.nodes[u].get("id", u))
+
+
+def component_fingerprint(g, component, settings = None):
+    """
+    Returns a canonical hash of the labelled nodes and edges of a component together with the inference settings.
+    Two components with the same entities and links get the same fingerprint, whatever their node numbers.
+
+    :param g: an undirected graph
+    :param component: the nodes of the component
+    :param settings: any JSON-serialisable description of the settings the result depends on
+    :return: a hexadecimal SHA-256 digest
+    """
+    keys = {u: node_key(g, u) for u in component}
+    edges = []
+    for u in component:
+        for v in g[u]:
+            if keys[u] < keys[v]:
+                edges.append([keys[u], keys[v], g[u][v].get("p")])
+    content = {"nodes": sorted(keys.values()), "edges": sorted(edges), "settings": settings}
+    return hashlib.sha256(json.dumps(content, sort_keys = True, default = str).encode("utf-8")).hexdigest()
+
+
+class ComponentCache(object):
+    """
+    On-disk cache of per-component predictions with a size bound.
+    Every entry is a small JSON file named after the component fingerprint, holding the predictions as ids.
+    Reading an entry refreshes its modification time and the least recently used entries are evicted first.
+    """
+
+    def __init__(self, directory, max_bytes = 256 * 1024 * 1024):
+        """
+        :param directory: the directory of the cache, created if needed
+        :param max_bytes: the maximum total size of the entries
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok = True)
+        self.total_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory) if name.endswith(".json"))
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """
+        Returns the predictions stored under the given fingerprint.
+
+        :param key: a component fingerprint
+        :return: an array of ((label, id), (label, id), probability) triples or None if not cached
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                found = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [(tuple(u), tuple(v), p) for u, v, p in found]
+
+    def put(self, key, predictions):
+        """
+        Stores the predictions of a component and evicts the least recently used entries beyond the size bound.
+
+        :param key: a component fingerprint
+        :param predictions: an array of ((label, id), (label, id), probability) triples
+        """
+        path = self._path(key)
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(predictions, f)
+        if os.path.exists(path):
+            self.total_bytes -= os.path.getsize(path)
+        self.total_bytes += os.path.getsize(temporary)
+        os.replace(temporary, path)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in its size bound.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        self.total_bytes = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            # evicting a little more than needed keeps the following writes from rescanning the directory
+            if self.total_bytes <= 0.9 * self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            self.total_bytes -= size
+
+    def clear(self):
+        """
+        Removes all the entries.
+        """
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                os.remove(os.path.join(self.directory, name))
+        self.total_bytes = 0
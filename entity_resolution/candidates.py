@@ -0,0 +1,158 @@
+import networkx as nx
+import numpy as np
+
+from .inference import get_components, component_upper_bound, component_couplings, get_supernode_weights
+from .similarity import get_kernel
+from .instrumentation import progress
+
+
+class CandidateTable(object):
+    """
+    Columnar table of (device, identity) couplings sorted from the most to the least probable.
+    Every row holds the device, the identity, the coupling, the length of the path and the attributes shared along it.
+    The table is computed once with a low floor, re-thresholding and top-N are then slices of the arrays.
+    """
+
+    def __init__(self, devices, identities, couplings, hops, attribute_offsets, attribute_values):
+        """
+        Use `build_candidate_table` rather than this constructor.
+        The attributes of row k are `attribute_values[attribute_offsets[k]:attribute_offsets[k + 1]]`.
+        """
+        self.devices = devices
+        self.identities = identities
+        self.couplings = couplings
+        self.hops = hops
+        self.attribute_offsets = attribute_offsets
+        self.attribute_values = attribute_values
+
+    def __len__(self):
+        return len(self.couplings)
+
+    def rows(self, selection):
+        """
+        Returns the table restricted to the given rows.
+
+        :param selection: a slice or an array of row indices in increasing order
+        :return: a candidate table
+        """
+        if isinstance(selection, slice):
+            start, stop, step = selection.indices(len(self))
+            if step == 1:
+                stop = max(start, stop)
+                offsets = self.attribute_offsets[start:stop + 1]
+                return CandidateTable(self.devices[start:stop], self.identities[start:stop], self.couplings[start:stop], self.hops[start:stop],
+                                      offsets - offsets[0], self.attribute_values[offsets[0]:offsets[-1]])
+            selection = np.arange(start, stop, step)
+        starts = self.attribute_offsets[selection]
+        counts = self.attribute_offsets[selection + 1] - starts
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        positions = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+        return CandidateTable(self.devices[selection], self.identities[selection], self.couplings[selection], self.hops[selection],
+                              offsets, self.attribute_values[positions])
+
+    def above(self, threshold):
+        """
+        Returns the rows with a coupling of at least the given threshold.
+
+        :param threshold: a probability
+        :return: a candidate table
+        """
+        # the couplings are sorted in decreasing order
+        return self.rows(slice(0, int(np.searchsorted(-self.couplings, -threshold, side = "right"))))
+
+    def top(self, max_predictions = 100):
+        """
+        Returns the most probable rows.
+
+        :param max_predictions: how many rows to keep, None for all of them
+        :return: a candidate table
+        """
+        return self if max_predictions is None else self.rows(slice(0, max_predictions))
+
+    def per_identity(self, max_predictions = 1):
+        """
+        Returns the most probable rows of every identity.
+
+        :param max_predictions: how many rows to keep per identity
+        :return: a candidate table
+        """
+        order = np.argsort(self.identities, kind = "stable")
+        grouped = self.identities[order]
+        starts = np.flatnonzero(np.concatenate([[True], grouped[1:] != grouped[:-1]])) if len(grouped) > 0 else np.zeros(0, dtype = np.int64)
+        ranks = np.arange(len(order)) - np.repeat(starts, np.diff(np.append(starts, len(order))))
+        return self.rows(np.sort(order[ranks < max_predictions]))
+
+    def attributes(self, k):
+        """
+        Returns the attributes shared along the path of the given row.
+
+        :param k: a row index
+        :return: an array of attribute nodes
+        """
+        return self.attribute_values[self.attribute_offsets[k]:self.attribute_offsets[k + 1]]
+
+    def to_predictions(self):
+        """
+        Returns the rows in the format of `infer_identities`.
+
+        :return: an array of (device, identity, probability) triples
+        """
+        return [(d.item() if isinstance(d, np.generic) else d, i.item() if isinstance(i, np.generic) else i, float(p))
+                for d, i, p in zip(self.devices, self.identities, self.couplings)]
+
+
+def __node_array(nodes):
+    if len(nodes) > 0 and all(isinstance(u, (int, np.integer)) for u in nodes):
+        return np.array(nodes, dtype = np.int64)
+    array = np.empty(len(nodes), dtype = object)
+    array[:] = nodes
+    return array
+
+
+def build_candidate_table(m: nx.DiGraph, floor = 0.01, max_hops = None, max_degree = None, supernode_strategy = "exclude", similarity = None):
+    """
+    Computes all the couplings above the given floor once, so that `CandidateTable.above`, `CandidateTable.top`
+    and `CandidateTable.per_identity` answer what `infer_identities` would return for any threshold and top-N above the floor.
+
+    :param m: the graph
+    :param floor: couplings below this number are not kept
+    :param max_hops: if specified, couplings along paths with more edges are not considered
+    :param max_degree: see `infer_identities`
+    :param supernode_strategy: see `infer_identities`
+    :param similarity: see `infer_identities`
+    :return: a candidate table
+    """
+    g = m.to_undirected(as_view = True)
+    weights = get_supernode_weights(m, max_degree, supernode_strategy)
+    kernel = None if similarity is None or similarity == "jaccard" else get_kernel(similarity)
+    devices = []
+    identities = []
+    couplings = []
+    hops = []
+    counts = []
+    values = []
+    for component in progress(get_components(m)):
+        if round(component_upper_bound(g, component, weights, kernel), 2) < floor:
+            continue
+        h = nx.Graph(g.subgraph(component))
+        for j, i, c, length, found in component_couplings(h, floor, max_hops, weights = weights, kernel = kernel):
+            shared = []
+            u = j
+            while found[u][2] is not None:
+                v = found[u][2]
+                # an intermediate identity linked to both devices also counts
+                if v != i and g.nodes[v]["label"] != "Device" and v not in shared:
+                    shared.append(v)
+                shared.extend(x for x in g[u] if x in g[v] and g.nodes[x]["label"] != "Device" and weights.get(x, 1.0) > 0 and x not in shared)
+                u = v
+            devices.append(j)
+            identities.append(i)
+            couplings.append(c)
+            hops.append(length)
+            counts.append(len(shared))
+            values.extend(shared)
+    couplings = np.array(couplings, dtype = np.float64)
+    order = np.argsort(-couplings, kind = "stable")
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    table = CandidateTable(__node_array(devices), __node_array(identities), couplings, np.array(hops, dtype = np.int32), offsets, __node_array(values))
+    return table.rows(order)
@@ -0,0 +1,95 @@
+import os
+import pickle
+import time
+
+
+class Checkpoint(object):
+    """
+    Work directory of a long inference run.
+    It holds the parsed graph and, saved at regular intervals, the finished components with the predictions found so far,
+    so an interrupted run can continue from the last finished component rather than from scratch.
+    """
+
+    graph_file = "graph.pickle"
+    progress_file = "progress.pickle"
+
+    def __init__(self, directory, interval = 60):
+        """
+        :param directory: the work directory, created if needed
+        :param interval: the minimum amount of seconds between two saves of the progress
+        """
+        self.directory = directory
+        self.interval = interval
+        self.settings = None
+        self.done = set()
+        self.predictions = []
+        self.saved_at = time.monotonic()
+        os.makedirs(directory, exist_ok = True)
+
+    def _write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(content, f, protocol = pickle.HIGHEST_PROTOCOL)
+        # a run killed while writing leaves the previous file intact
+        os.replace(path + ".tmp", path)
+
+    def _read(self, name):
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def save_graph(self, g):
+        """
+        Saves the parsed graph.
+
+        :param g: a graph
+        """
+        self._write(self.graph_file, g)
+
+    def load_graph(self):
+        """
+        Returns the saved graph.
+
+        :return: a graph or None if none was saved
+        """
+        return self._read(self.graph_file)
+
+    def start(self, settings):
+        """
+        Loads the progress of a previous run with the same settings, if any.
+
+        :param settings: a dictionary describing the run, a saved progress with other settings cannot be resumed
+        :return: the amount of finished components
+        """
+        self.settings = settings
+        progress = self._read(self.progress_file)
+        if progress is None:
+            return 0
+        if progress["settings"] != settings:
+            raise Exception(f"The checkpoint in '{self.directory}' was made with other settings ({progress['settings']}) and cannot be resumed.")
+        self.done = progress["done"]
+        self.predictions = progress["predictions"]
+        return len(self.done)
+
+    def record(self, component, heap):
+        """
+        Marks a component as finished and saves the progress if the interval has elapsed.
+
+        :param component: the index of the component
+        :param heap: the heap of the best predictions, see `push_prediction`
+        """
+        self.done.add(component)
+        if time.monotonic() - self.saved_at >= self.interval:
+            self.save(heap)
+
+    def save(self, heap):
+        """
+        Saves the progress.
+
+        :param heap: the heap of the best predictions, see `push_prediction`
+        """
+        self.predictions = [entry[2] for entry in heap]
+        self._write(self.progress_file, {"settings": self.settings, "done": self.done, "predictions": self.predictions})
+        self.saved_at = time.monotonic()
@@ -0,0 +1,180 @@
+import networkx as nx
+import numpy as np
+
+
+class CompactGraph(object):
+    """
+    Array-backed, read-only graph.
+    Node labels are small integer codes, node ids live in an interned string table stored as one UTF-8 buffer,
+    the adjacency is kept as CSR arrays and the edge probabilities in a float array.
+    The nodes carrying a label are indexed, so label filters are lookups rather than scans.
+    """
+
+    def __init__(self, node_keys, label_names, codes, id_data, id_offsets, id_codes, sources, targets, edge_label_names, edge_codes, p, directed = True):
+        """
+        Use `CompactGraph.from_networkx` rather than this constructor.
+        """
+        self.node_keys = node_keys
+        self.label_names = label_names
+        self.codes = codes
+        self.id_data = id_data
+        self.id_offsets = id_offsets
+        self.id_codes = id_codes
+        self.sources = sources
+        self.targets = targets
+        self.edge_label_names = edge_label_names
+        self.edge_codes = edge_codes
+        self.p = p
+        self.directed = directed
+
+        # undirected CSR adjacency, every entry refers back to its edge
+        n = len(codes)
+        rows = np.concatenate([sources, targets])
+        cols = np.concatenate([targets, sources])
+        edges = np.concatenate([np.arange(len(sources), dtype = sources.dtype), np.arange(len(sources), dtype = sources.dtype)])
+        order = np.lexsort((cols, rows))
+        self.indices = cols[order]
+        self.edge_indices = edges[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength = n))]).astype(np.int64)
+
+        order = np.argsort(codes, kind = "stable")
+        boundaries = np.searchsorted(codes[order], np.arange(len(label_names) + 1))
+        self.label_index = {label: order[boundaries[k]:boundaries[k + 1]].astype(sources.dtype) for k, label in enumerate(label_names)}
+
+    @classmethod
+    def from_networkx(cls, g):
+        """
+        Converts the given networkx graph with 'label' and 'id' node attributes.
+
+        :param g: a graph
+        :return: a compact graph, node k corresponds to the k-th node of `g.nodes()`
+        """
+        nodes = list(g.nodes())
+        position = {u: k for k, u in enumerate(nodes)}
+        # positions fit in 32 bits for all but gigantic graphs
+        index_type = np.int32 if max(len(nodes), g.number_of_edges()) < 2 ** 31 else np.int64
+        label_names = []
+        label_code = {}
+        codes = np.empty(len(nodes), dtype = np.int8)
+        id_code = {}
+        id_codes = np.empty(len(nodes), dtype = index_type)
+        for k, u in enumerate(nodes):
+            label = g.nodes[u]["label"]
+            if label not in label_code:
+                label_code[label] = len(label_names)
+                label_names.append(label)
+            codes[k] = label_code[label]
+            id = str(g.nodes[u].get("id", ""))
+            if id not in id_code:
+                id_code[id] = len(id_code)
+            id_codes[k] = id_code[id]
+        encoded = [id.encode("utf-8") for id in id_code]
+        id_offsets = np.concatenate([[0], np.cumsum([len(b) for b in encoded])]).astype(np.int64)
+        id_data = np.frombuffer(b"".join(encoded), dtype = np.uint8)
+
+        edge_count = g.number_of_edges()
+        sources = np.empty(edge_count, dtype = index_type)
+        targets = np.empty(edge_count, dtype = index_type)
+        edge_label_names = []
+        edge_label_code = {}
+        edge_codes = np.empty(edge_count, dtype = np.int8)
+        p = np.full(edge_count, np.nan, dtype = np.float32)
+        for k, (u, v, d) in enumerate(g.edges(data = True)):
+            sources[k] = position[u]
+            targets[k] = position[v]
+            label = d.get("label", "")
+            if label not in edge_label_code:
+                edge_label_code[label] = len(edge_label_names)
+                edge_label_names.append(label)
+            edge_codes[k] = edge_label_code[label]
+            if "p" in d:
+                p[k] = d["p"]
+
+        if all(isinstance(u, (int, np.integer)) for u in nodes):
+            node_keys = np.array(nodes, dtype = np.int64)
+        else:
+            node_keys = nodes
+        return cls(node_keys, label_names, codes, id_data, id_offsets, id_codes, sources, targets, edge_label_names, edge_codes, p, g.is_directed())
+
+    def to_networkx(self):
+        """
+        Converts back to a networkx graph.
+
+        :return: a DiGraph or a Graph, depending on the graph this was created from
+        """
+        g = nx.DiGraph() if self.directed else nx.Graph()
+        for k in range(self.number_of_nodes()):
+            g.add_node(self.node_key(k), label = self.label(k), id = self.id(k))
+        for k in range(self.number_of_edges()):
+            d = {"label": self.edge_label_names[self.edge_codes[k]]}
+            if not np.isnan(self.p[k]):
+                d["p"] = float(self.p[k])
+            g.add_edge(self.node_key(self.sources[k]), self.node_key(self.targets[k]), **d)
+        return g
+
+    def number_of_nodes(self):
+        return len(self.codes)
+
+    def number_of_edges(self):
+        return len(self.sources)
+
+    def node_key(self, u):
+        """
+        Returns the networkx node corresponding to the given position.
+        """
+        key = self.node_keys[u]
+        return int(key) if isinstance(key, np.integer) else key
+
+    def label(self, u):
+        """
+        Returns the label of the node at the given position.
+        """
+        return self.label_names[self.codes[u]]
+
+    def id(self, u):
+        """
+        Returns the id of the node at the given position.
+        """
+        k = self.id_codes[u]
+        return self.id_data[self.id_offsets[k]:self.id_offsets[k + 1]].tobytes().decode("utf-8")
+
+    def nodes_with_label(self, label):
+        """
+        Returns the positions of the nodes with the given label.
+
+        :param label: a node label
+        :return: a sorted array of positions
+        """
+        if label not in self.label_index:
+            return np.zeros(0, dtype = self.sources.dtype)
+        return self.label_index[label]
+
+    def neighbors(self, u):
+        """
+        Returns the positions of the nodes adjacent to the given one, ignoring the edge direction.
+        """
+        return self.indices[self.indptr[u]:self.indptr[u + 1]]
+
+    def degree(self, u = None):
+        """
+        Returns the undirected degree of the given node, or of all nodes if none is specified.
+        """
+        if u is None:
+            return np.diff(self.indptr)
+        return int(self.indptr[u + 1] - self.indptr[u])
+
+    def edge_probabilities(self, u):
+        """
+        Returns the probabilities of the edges adjacent to the given node, NaN where an edge has none.
+        """
+        return self.p[self.edge_indices[self.indptr[u]:self.indptr[u + 1]]]
+
+    def nbytes(self):
+        """
+        Returns the amount of bytes held by the arrays of this graph.
+        """
+        arrays = [self.codes, self.id_data, self.id_offsets, self.id_codes, self.sources, self.targets, self.edge_codes, self.p, self.indices, self.edge_indices, self.indptr]
+        arrays += list(self.label_index.values())
+        if isinstance(self.node_keys, np.ndarray):
+            arrays.append(self.node_keys)
+        return sum(a.nbytes for a in arrays)
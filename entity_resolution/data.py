@@ -2,15 +2,17 @@ from typing import List, Union, Any
 
 import networkx as nx
 import numpy as np
-import os, uuid, random, multiprocessing, json, glob, gzip
+import os, uuid, random, multiprocessing, json, glob, gzip, re, functools
 from faker import Faker
 from boto3.session import Session
 import boto3, uuid
 from pathlib import Path
 from urllib.parse import urlparse
-from tqdm import tqdm
 from neo4j import GraphDatabase
 
+from .unionfind import UnionFind
+from .instrumentation import instrumented, span, count, log, progress
+
 fake = Faker()
 
 __transform_keys: List[str] = ["Device", "IP", "Location", "Identity", "Cookie"]
@@ -216,9 +218,9 @@ class Neo(object):
             q = f"DROP DATABASE {name} IF EXISTS"
             with self._driver.session() as graphDB_Session:
                 graphDB_Session.run(q)
-            print(f"Database '{name}' has been removed.")
+            log(f"Database '{name}' has been removed.")
         else:
-            print(f"Database '{name}' does not exist.")
+            log(f"Database '{name}' does not exist.")
 
     def create_database(self, db_name):
         """
@@ -234,7 +236,7 @@ class Neo(object):
         q = f"create database {db_name}"
         with self._driver.session() as graphDB_Session:
             graphDB_Session.run(q)
-        print(f"Database '{db_name}' has been created.")
+        log(f"Database '{db_name}' has been created.")
 
     def truncate_db(self, db_name):
         """
@@ -268,14 +270,14 @@ class Neo(object):
                 self.truncate_db(db_name)
 
         with self._driver.session(database = db_name) as graphDB_Session:
-            print("Creating nodes")
-            for i in tqdm(g.nodes()):
+            log("Creating nodes")
+            for i in progress(g.nodes()):
                 id = g.nodes()[i]["id"]
                 label = g.nodes()[i]["label"]
                 q = f"Create (n:{label}{{id: $id}})"
                 graphDB_Session.run(q, {"id": id})
-            print("Creating edges")
-            for u, v in tqdm(g.edges()):
+            log("Creating edges")
+            for u, v in progress(g.edges()):
                 s_id = g.nodes()[u]["id"]
                 t_id = g.nodes()[v]["id"]
 
@@ -298,7 +300,7 @@ class Neo(object):
                                 Merge (u)-[:{edge_label}]->(v)
                                 """
                     graphDB_Session.run(q, {"s": s_id, "t": t_id})
-        print("Done.")
+        log("Done.")
 
     def get_graph(self, db_name, max_nodes = 5000, max_edges = 5000):
         """
@@ -351,7 +353,7 @@ class Neo(object):
                     g.add_edge(i, j, label = e_label)
         components = list(nx.connected_components(g.to_undirected()))
         largest = [len(c) for c in sorted(components, key = len, reverse = True)][0]
-        print(f"Nodes:", len(g.nodes()), "Edges:", len(g.edges()), "Components:", len(components), "Largest component:", largest)
+        log(f"Nodes:", len(g.nodes()), "Edges:", len(g.edges()), "Components:", len(components), "Largest component:", largest)
         return g
 
     def write_predictions(self, db_name, predictions):
@@ -361,7 +363,7 @@ class Neo(object):
         :param db_name: the name of the datbase
         :param predictions: the prediction tuples to export
         """
-        with self._driver.session(database = db_name) as graphDB_Session:
+        with span("output"), self._driver.session(database = db_name) as graphDB_Session:
             for s, t, p in predictions:
                 q = """
                 Match (u:Device{id: $u})
@@ -369,13 +371,13 @@ class Neo(object):
                 Merge (u)-[:INFERRED{p: $p}]->(v)
                 """
                 graphDB_Session.run(q, {"u": s, "v": t, "p": p})
-        print(f"Written {len(predictions)} prediction(s) to the '{db_name}' database.")
+        log(f"Written {len(predictions)} prediction(s) to the '{db_name}' database.")
 
     def remove_inferred_edges(self, db_name):
         with self._driver.session(database = db_name) as graphDB_Session:
             q = "Match ()-[r:INFERRED]->() delete r"
             graphDB_Session.run(q)
-        print(f"All INFERRED edges have been removed from database '{db_name}'.")
+        log(f"All INFERRED edges have been removed from database '{db_name}'.")
 
 
 def __add_node(g, label, id):
@@ -392,18 +394,26 @@ def __add_node(g, label, id):
     return i
 
 
-def __add_nodes(g, label, count):
+def __new_id(rng):
+    """
+    Returns a random UUID string drawn from the given `random.Random`, so seeding it makes the ids reproducible.
+    """
+    return str(uuid.UUID(int = rng.getrandbits(128), version = 4))
+
+
+def __add_nodes(g, label, count, rng):
     """
     Adds a bunch of nodes with the specified label.
 
     :param g: the graph
     :param label: the label
     :param count: how many nodes to add
+    :param rng: the `random.Random` drawing the ids
     :return: a mapping from node index to node id
     """
     dic = {}
     for _ in range(count):
-        id = str(uuid.uuid4())
+        id = __new_id(rng)
         i = __add_node(g, label, id)
         dic[i] = id
     return dic
@@ -421,27 +431,39 @@ def __connect(g, i, j, label):
     g.add_edge(i, j, label = label)
 
 
-def __add_cookies(g, device_dic, p = 0.3):
+def __add_cookies(g, device_dic, rng, np_rng, p = 0.3, truth = None, affinity = 0.8):
     """
     All devices have a cookie with the same id by default.
     In addition there is a p chance that another one is shared
     and a (1-p) chance that a dangling one is added.
+    If the hidden identities of the devices are given, the shared cookie belongs
+    to a device of the same identity with the given affinity.
+    The draws come from the given `random.Random` and numpy generator.
     """
     dic = {}
+    owners = {}
+    members = {}
     for i in device_dic:
         id = device_dic[i]
         # always add the default cookie
         j = __add_node(g, "Cookie", id)
         dic[j] = id
+        owners[i] = j
+        if truth is not None:
+            members.setdefault(truth[i], []).append(i)
         __connect(g, i, j, "HAS_COOKIE")
     for i in device_dic:
+        siblings = [] if truth is None else [owners[u] for u in members[truth[i]] if u != i]
         #  chance to random __connect to another
-        if random.random() < p and len(dic.keys()) > 1:
-            j = np.random.choice([u for u in dic.keys() if u != i])
+        if rng.random() < p and len(dic.keys()) > 1:
+            if len(siblings) > 0 and rng.random() < affinity:
+                j = siblings[rng.randrange(len(siblings))]
+            else:
+                j = np_rng.choice([u for u in dic.keys() if u != i])
             assert i != j, ">>>"
             __connect(g, i, j, "HAS_COOKIE")
         else:
-            id = str(uuid.uuid4())
+            id = __new_id(rng)
             j = __add_node(g, "Cookie", id)
             dic[j] = i
             __connect(g, i, j, "HAS_COOKIE")
@@ -449,18 +471,20 @@ def __add_cookies(g, device_dic, p = 0.3):
     return dic
 
 
-def __add_other(g, device_dic, label, p = 0.5):
+def __add_other(g, device_dic, label, rng, np_rng, p = 0.5):
     """
     Add the location or ip nodes.
 
     :param g:
     :param device_dic:
     :param label:
+    :param rng: the `random.Random` of the draws
+    :param np_rng: the numpy generator of the draws
     :param p:
     :return:
     """
     upper_label = str.upper(label)
-    capital_label = str.capitalize(label)
+    capital_label = "IP" if upper_label == "IP" else str.capitalize(label)
     if not upper_label in ["IP", "LOCATION"]:
         raise Exception("Unexpected label '{label}'. Only IP or Location is supported.")
     dic = {}
@@ -475,21 +499,21 @@ def __add_other(g, device_dic, label, p = 0.5):
         device_is = list(g.predecessors(w))
         assert len(device_is) >= 2
 
-        u, v = np.random.choice(device_is, 2, replace = False)
+        u, v = np_rng.choice(device_is, 2, replace = False)
         assert u != v
         return u, v
 
     shared_cookies = [u for u in g.nodes() if g.nodes()[u]["label"] == "Cookie" and (g.degree(u) >= 2)]
 
     for cookie_i in shared_cookies:
-        if random.random() < p:
+        if rng.random() < p:
 
             u, v = get_parent_devices(cookie_i)
             if has_other(u) or has_other(v):
                 continue
             assert not u is None and g.has_node(u)
             assert not v is None and g.has_node(v)
-            id = str(uuid.uuid4())
+            id = __new_id(rng)
             other_i = __add_node(g, capital_label, id)
             dic[other_i] = id
 
@@ -501,7 +525,7 @@ def __add_other(g, device_dic, label, p = 0.5):
         if has_other(device_i):
             continue
         else:
-            id = str(uuid.uuid4())
+            id = __new_id(rng)
             other_i = __add_node(g, capital_label, id)
             dic[other_i] = id
             __connect(g, device_i, other_i, f"HAS_{upper_label}")
@@ -509,36 +533,50 @@ def __add_other(g, device_dic, label, p = 0.5):
     return dic
 
 
-def create_synthetic_graph(device_count = 150, identity_count = 50, cookie_probability = 0.3, ip_probability = 0.3, location_probability = 0.3) -> object:
+def create_synthetic_graph(device_count = 150, identity_count = 50, cookie_probability = 0.3, ip_probability = 0.3, location_probability = 0.3, seed = None, identity_affinity = None) -> object:
     """
     Returns a graph with the same topological features as real-world dataset.
+    Every device secretly belongs to an identity but only one device per identity is linked to it.
+    This hidden truth is available as the `truth` attribute of the graph, a dictionary device node -> identity node,
+    see `evaluate_predictions`.
 
     :param device_count: how many devices to create
     :param identity_count: how many identities to create
     :param cookie_probability: the probability that a cookie is shared
     :param ip_probability: the probability that an IP node is shared
     :param location_probability: the probability that a Location node is shared
+    :param seed: if specified, the same graph (including the ids) is generated for the same seed, the global random state is left alone
+    :param identity_affinity: if specified, the probability that a shared cookie is shared with a device of the same identity rather than with any device, by default any device
     :return: a graph
     """
     if identity_count > device_count:
         raise Exception("The device count should be larger than the identity count.")
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
     g = nx.DiGraph()
-    device_dic = __add_nodes(g, "Device", device_count)
-    identity_dic = __add_nodes(g, "Identity", identity_count)
+    device_dic = __add_nodes(g, "Device", device_count, rng)
+    identity_dic = __add_nodes(g, "Identity", identity_count, rng)
     # assigning the identities to the devices
     target_ids = list(identity_dic.keys())
-    source_ids = np.random.choice(
+    source_ids = np_rng.choice(
         list(device_dic.keys()), identity_count, replace = False)
     for t in zip(source_ids, target_ids):
         __connect(g, *t, "HAS_IDENTITY")
+    # the devices without an identity edge still belong to one
+    truth = {int(u): i for u, i in zip(source_ids, target_ids)}
+    for u in device_dic:
+        if u not in truth:
+            truth[u] = target_ids[rng.randrange(identity_count)]
 
-    cookie_dic = __add_cookies(g, device_dic, cookie_probability)
+    related = identity_count > 0 and identity_affinity is not None
+    cookie_dic = __add_cookies(g, device_dic, rng, np_rng, cookie_probability, truth if related else None, identity_affinity)
 
-    ip_dic = __add_other(g, device_dic, "IP", ip_probability)
-    location_dic = __add_other(g, device_dic, "Location", location_probability)
+    ip_dic = __add_other(g, device_dic, "IP", rng, np_rng, ip_probability)
+    location_dic = __add_other(g, device_dic, "Location", rng, np_rng, location_probability)
 
     # the info can be used to print out stats
     g.info = f"Nodes: {len(g.nodes())}, Edges: {len(g.edges())}"
+    g.truth = truth
     return g
 
 
@@ -561,7 +599,7 @@ def create_synthetic_graphml_graph(add_inference = True, device_count = 150, ide
         inf = infer_identities(g)
         g.add_edges_from([(u, v, {"p": p}) for u, v, p in inf], label = "INFERRED")
     graphml_path = os.path.join(os.getcwd(), "synthetic.graphml")
-    print("GraphML diagram at ", graphml_path)
+    log("GraphML diagram at ", graphml_path)
     nx.write_graphml(g, graphml_path)
     os.system(f"open {graphml_path}")
     return g
@@ -581,7 +619,7 @@ def create_synthetic_gephi_graph(device_count = 150, identity_count = 50, cookie
             """
     g = create_synthetic_graph(device_count, identity_count, cookie_probability, ip_probability, location_probability)
     gephi_path = os.path.join(os.getcwd(), "synthetic.gexf")
-    print("GraphML diagram at ", gephi_path)
+    log("GraphML diagram at ", gephi_path)
     nx.write_gexf(g, gephi_path)
     os.system(f"open {gephi_path}")
     return g
@@ -734,75 +772,157 @@ def get_city_from_string(ctx: str):
     return None, None
 
 
+class RawLineExtractor(object):
+    """
+    Turns raw TSV lines into entities, see `transform_raw_line_to_entity`.
+    The column positions are worked out once, a line is only split up to the last needed column
+    and the location context is cut out of the context string and parsed with a regular expression when it has the usual layout,
+    with a fallback on the JSON parser. The parsed location contexts are kept in an LRU cache: unlike the whole context string,
+    which carries the headers and user agent of every request, they repeat across the lines of a city.
+    """
+
+    raw_columns = ["DOMAIN_USERID", "USER_IPADDRESS", "DERIVED_CONTEXTS", "USER_ID", "NETWORK_USERID"]
+    """The raw columns of the entity keys, in the same order."""
+
+    entity_keys = ["Device", "IP", "Location", "Identity", "Cookie"]
+    """The keys of an entity."""
+
+    location_schema = "iglu:com.dbip/location/jsonschema/1-0-0"
+
+    location_pattern = re.compile(r'"schema"\s*:\s*"iglu:com\.dbip/location/jsonschema/1-0-0"\s*,\s*"data"\s*:\s*')
+    """The start of a location context whose data follows the schema, a context in another layout goes through the JSON parser."""
+
+    city_pattern = re.compile(r'\{\s*"city"\s*:\s*\{\s*"geoname_id"\s*:\s*(?:"([^"\\]*)"|(-?\d+)\s*[,}])')
+    """The data of a location context with the city id as first field."""
+
+    def __init__(self, keys = None, sep = "\t", cache_size = 4096):
+        """
+        :param keys: the column names of the raw lines, by default `get_raw_keys()`
+        :param sep: the separator
+        :param cache_size: the amount of parsed location contexts to keep
+        """
+        keys = list(get_raw_keys() if keys is None else keys)
+        self.positions = [keys.index(column) for column in self.raw_columns]
+        self.sep = sep
+        self.max_split = max(self.positions) + 1
+        self.parse_location = functools.lru_cache(maxsize = cache_size)(self._parse_location)
+
+    def _parse_location(self, data):
+        """
+        Returns the city id in the data of a location context, None if it has no city.
+        """
+        found = self.city_pattern.match(data)
+        if found is not None:
+            return found.group(1) if found.group(1) is not None else found.group(2)
+        try:
+            data = json.JSONDecoder().raw_decode(data)[0]
+        except ValueError:
+            return None
+        city = data.get("city") if isinstance(data, dict) else None
+        return None if city is None else str(city["geoname_id"])
+
+    def location(self, ctx):
+        """
+        Returns the city id of a context string, like `get_city_from_string`.
+
+        :param ctx: the derived contexts of a raw line
+        :return: the city id or None
+        """
+        found = None
+        for found in self.location_pattern.finditer(ctx):
+            # the data runs until the next context
+            end = ctx.find('"schema"', found.end())
+            city = self.parse_location(ctx[found.end():len(ctx) if end < 0 else end])
+            if city is not None:
+                return city
+        if found is None:
+            return get_city_from_string(ctx)[0]
+        return None
+
+    def extract(self, line):
+        """
+        Turns a raw line into an entity.
+
+        :param line: the TSV line, a string or bytes
+        :return: an entity with the keys `entity_keys`, the device is blank when the line has none
+        """
+        if type(line) == bytes:
+            line = line.decode("utf-8")
+        values = line.split(self.sep, self.max_split)
+        device, ip, ctx, identity, cookie = [values[k] for k in self.positions]
+        return {"Device": str.strip(device), "IP": ip, "Location": self.location(ctx), "Identity": identity, "Cookie": cookie}
+
+    def extract_many(self, lines):
+        """
+        Turns a batch of raw lines into entities, the lines without device are skipped.
+
+        :param lines: an iterable of TSV lines, strings or bytes
+        :return: an array of entities
+        """
+        coll = []
+        for line in lines:
+            entity = self.extract(line)
+            if len(entity["Device"]) > 0:
+                coll.append(entity)
+        return coll
+
+
+__extractors = {}
+"""The extractor of every separator used with `transform_raw_line_to_entity`."""
+
+
 def transform_raw_line_to_entity(line, sep = "\t"):
     """
     Turns the raw TSV line into an entity.
+    Use a `RawLineExtractor` directly to parse many lines.
 
     :param line: the TSV line
     :param sep: the separator
     :return: an entity
     """
-    ha = np.array(get_raw_keys())
-    device_position = np.argwhere(ha == "DOMAIN_USERID")[0][0]
-    identity_position = np.argwhere(ha == "USER_ID")[0][0]
-    cookie_position = np.argwhere(ha == "NETWORK_USERID")[0][0]
-    ip_position = np.argwhere(ha == "USER_IPADDRESS")[0][0]
-    context_position = np.argwhere(ha == "DERIVED_CONTEXTS")[0][0]
-    if type(line) == bytes:
-        values = line.decode("utf-8").split(sep)
-    else:
-        values = line.split(sep)
-    device = str.strip(values[device_position])
-    if len(device) == 0:
-        None
-    identity = values[identity_position]
-    ip = values[ip_position]
-    cookie = values[cookie_position]
-    ctx = values[context_position]
-    location = get_city_from_string(ctx)[0]
-    entity = {k: v for k, v in zip(__transform_keys, [device, ip, location, identity, cookie])}
-    # print([device_position, ip_position, context_position, identity_position, cookie_position])
-    return entity
+    extractor = __extractors.get(sep)
+    if extractor is None:
+        extractor = __extractors[sep] = RawLineExtractor(sep = sep)
+    return extractor.extract(line)
 
 
+def iter_raw_entities(raw_directory):
+    """
+    Yields the entities of the gzip files in the given directory, decompressing one line at a time.
+    Nothing is kept once an entity has been consumed, so the memory does not grow with the amount of files.
+
+    :param raw_directory: the directory containing the gzip files
+    :return: an iterator of entities, see `transform_raw_line_to_entity`
+    """
+    extractor = RawLineExtractor()
+    files = get_files(raw_directory)
+    log(f"Reading {len(files)} file(s) in directory '{raw_directory}'.")
+    for file_path in progress(files):
+        lines = 0
+        entities = 0
+        with gzip.open(file_path, "rb") as f:
+            for line in f:
+                lines += 1
+                entity = extractor.extract(line)
+                if len(entity["Device"]) == 0:
+                    continue
+                entities += 1
+                yield entity
+        count("raw lines", lines)
+        count("entities", entities)
+
+
+@instrumented("parse")
 def raw_to_entities_json(raw_directory, output_directory = None):
     """
     Transforms the data contained as gzip files in the given directory to JSON entity in another directory.
+    Use `iter_raw_entities` to process the entities without holding them all in memory.
 
     :param raw_directory:
     :param output_directory:
     :return:
     """
-    ha = np.array(get_raw_keys())
-    device_position = np.argwhere(ha == "DOMAIN_USERID")[0][0]
-    identity_position = np.argwhere(ha == "USER_ID")[0][0]
-    cookie_position = np.argwhere(ha == "NETWORK_USERID")[0][0]
-    ip_position = np.argwhere(ha == "USER_IPADDRESS")[0][0]
-    context_position = np.argwhere(ha == "DERIVED_CONTEXTS")[0][0]
-
-    # print(device_position, identity_position, cookie_position, ip_position, context_position)
-
-
-    coll = []
-
-    files = get_files(raw_directory)
-    print(f"Reading {len(files)} file(s) in directory '{raw_directory}'.")
-    for file_path in tqdm(files):
-
-        with gzip.open(file_path, "rb") as f:
-            lines = f.readlines()
-            for i, line in enumerate(lines):
-                values = line.decode("utf-8").split("\t")
-                device = str.strip(values[device_position])
-                if len(device) == 0:
-                    continue
-                identity = values[identity_position]
-                ip = values[ip_position]
-                cookie = values[cookie_position]
-                ctx = values[context_position]
-                location = get_city_from_string(ctx)[0]
-                entity = {k: v for k, v in zip(__transform_keys, [device, ip, location, identity, cookie])}
-                coll.append(entity)
+    coll = list(iter_raw_entities(raw_directory))
     if not output_directory is None:
         # ensure the directory is there
         Path(output_directory).mkdir(parents = True, exist_ok = True)
@@ -811,7 +931,7 @@ def raw_to_entities_json(raw_directory, output_directory = None):
         output_path = os.path.join(local_dir, 'raw.json')
         with open(output_path, 'w') as f:
             json.dump(coll, f)
-        print("Written to ", os.path.join(local_dir, 'raw.json'))
+        log("Written to ", os.path.join(local_dir, 'raw.json'))
     return coll
 
 
@@ -868,25 +988,54 @@ def graph_to_raw(g, raw_directory, lines_per_file = 1000):
         file_path = os.path.join(raw_directory, f"data{file_number}.gz")
         with gzip.open(file_path, 'wb') as f:
             f.write("\n".join(coll).encode())
-    print(f"Written {file_number} file(s) in '{raw_directory}'.")
+    log(f"Written {file_number} file(s) in '{raw_directory}'.")
 
 
 def raw_to_graph(raw_directory):
     """
     Returns the graph contained in the directory with the raw files.
+    The entities are streamed from the files into the graph, the parsing is then part of the 'graph build' span.
+    See `entities_json_to_graph` for the union-find attached to it.
 
-    :param json_data:
-    :return:
+    :param raw_directory: the directory containing the gzip files
+    :return: a graph
+    """
+    return entities_json_to_graph(iter_raw_entities(raw_directory))
+
+
+def normalize_entity_id(id):
+    """
+    Returns the canonical form of an entity id, the one used as 'id' of the graph nodes.
+
+    :param id: a raw id
+    :return: the trimmed, lowercase id or None if the id is blank
+    """
+    id = str.strip(str.lower(str(id)))
+    if id == "nan" or id == "none" or id == "":
+        return None
+    return id
+
+
+def graph_fingerprint(g):
+    """
+    Returns an order-independent fingerprint of the nodes and edges of a graph, used to tell whether the graph changed.
+    Replacing an edge by another changes it although the amounts of nodes and edges stay the same.
+    The string hashes are salted per process, so a fingerprint is only comparable within one process.
+
+    :param g: a graph
+    :return: an integer
     """
-    entities_json = raw_to_entities_json(raw_directory)
-    return entities_json_to_graph(entities_json)
+    return sum(map(hash, g.nodes())) + sum(map(hash, g.edges()))
 
 
+@instrumented("graph build")
 def entities_json_to_graph(entities_json):
     """
     Turns the given set of entities to a graph.
+    The connected components are tracked while the edges are added and the resulting union-find
+    is available as the `union_find` attribute of the graph, together with the `graph_fingerprint` of the graph it describes as `union_find_fingerprint`.
 
-    :param entities_json: the array of entities
+    :param entities_json: the array of entities or any iterable of them, like `iter_raw_entities`
     :return: a graph
     """
     device_nodes = {}
@@ -896,15 +1045,17 @@ def entities_json_to_graph(entities_json):
     cookie_nodes = {}
     label_dic = {"Device": device_nodes, "IP": ip_nodes, "Location": location_nodes, "Identity": identity_nodes, "Cookie": cookie_nodes}
     g = nx.DiGraph()
+    union_find = UnionFind()
 
     def get_node_index(label, id):
-        id = str.strip(str.lower(str(id)))
-        if id == "nan" or id == "none" or id == "":
+        id = normalize_entity_id(id)
+        if id is None:
             return None
         dic = label_dic[label]
         if not id in dic:
             i = len(g.nodes())
             g.add_node(i, label = label, id = id)
+            union_find.add(i)
             dic[id] = i
             # # case of a Device there is always a Cookie with the same id
             # if label == "Device":
@@ -918,11 +1069,12 @@ def entities_json_to_graph(entities_json):
             return
         g.add_edge(device_index, target_index,
                    label = "HAS_" + str.upper(target_label))
+        union_find.union(device_index, target_index)
 
     for r in entities_json:
         device_index = get_node_index("Device", r["Device"])
         if device_index is None:
-            print("oops, no device index here")
+            log("oops, no device index here")
             # raise Exception("Device with nil id")
             continue
         ip_index = get_node_index("IP", r["IP"])
@@ -934,6 +1086,8 @@ def entities_json_to_graph(entities_json):
         connect(device_index, "Location", location_index)
         connect(device_index, "Identity", identity_index)
         connect(device_index, "Cookie", cookie_index)
+    g.union_find = union_find
+    g.union_find_fingerprint = graph_fingerprint(g)
     return g
 
 
@@ -982,7 +1136,7 @@ def download_s3_folder(s3_uri = "s3://your-thing/your-bucket/", local_dir = "./r
         if obj.key[-1] == '/':
             continue
         bucket.download_file(obj.key, str(target))
-        print(obj.key)
+        log(obj.key)
 
 
 def create_neo_database(db_name = "newDatabase", uri = "bolt://localhost:7687", user = "neo4j", password = "123"):
@@ -0,0 +1,104 @@
+import pandas as pd
+
+from .benchmark import measure
+from .data import create_synthetic_graph
+from .inference import infer_identities
+from .instrumentation import instrumentation
+
+default_variants = {
+    "networkx": {},
+    "sparse": {"engine": "sparse"},
+    "minhash 64/32": {"engine": "minhash", "num_perm": 64, "bands": 32},
+    "minhash 128/64": {"engine": "minhash", "num_perm": 128, "bands": 64},
+    "max hops 3": {"max_hops": 3},
+    "supernodes excluded": {"max_degree": 5},
+    "supernodes downweighted": {"max_degree": 5, "supernode_strategy": "downweight"},
+    "adamic-adar": {"similarity": "adamic_adar"},
+    "resource allocation": {"similarity": "resource_allocation"},
+}
+"""The inference settings compared by `evaluate_variants`, as keyword arguments of `infer_identities`."""
+
+
+def get_truth_pairs(g, truth = None):
+    """
+    Returns the (device, identity) couples an inference should find: the hidden memberships which are not already an edge.
+
+    :param g: a graph
+    :param truth: a dictionary device -> identity, by default the `truth` attribute of graphs from `create_synthetic_graph`
+    :return: a set of (device, identity) couples
+    """
+    if truth is None:
+        truth = getattr(g, "truth", None)
+        if truth is None:
+            raise Exception("The graph carries no truth, use a graph from `create_synthetic_graph` or specify it.")
+    return {(u, i) for u, i in truth.items() if not g.has_edge(u, i) and not g.has_edge(i, u)}
+
+
+def evaluate_predictions(g, predictions, truth = None):
+    """
+    Compares predictions against the hidden device-identity truth.
+
+    :param g: a graph
+    :param predictions: an array of (device, identity, probability) triples, as returned by `infer_identities`
+    :param truth: a dictionary device -> identity, see `get_truth_pairs`
+    :return: a dictionary with the amount of 'predictions', 'correct' ones and 'expected' ones, the 'precision', 'recall' and 'f1'
+    """
+    expected = get_truth_pairs(g, truth)
+    predicted = {(u, i) for u, i, p in predictions}
+    correct = len(predicted & expected)
+    precision = correct / len(predicted) if len(predicted) > 0 else 0.0
+    recall = correct / len(expected) if len(expected) > 0 else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    return {"predictions": len(predicted), "correct": correct, "expected": len(expected), "precision": precision, "recall": recall, "f1": f1}
+
+
+def evaluate_variants(g = None, variants = None, threshold = 0.1, max_predictions = None, trace_memory = True, device_count = 5000, identity_count = 1000, seed = 1, identity_affinity = 0.8):
+    """
+    Runs inference variants on a graph with a known truth and reports their accuracy next to their cost.
+
+    :param g: a graph with a `truth` attribute, by default a seeded synthetic graph is generated
+    :param variants: a dictionary name -> keyword arguments of `infer_identities`, see `default_variants`
+    :param threshold: predictions with a probability below this number will be ignored
+    :param max_predictions: the maximum amount of predictions per variant, None for all of them
+    :param trace_memory: whether to measure the peak of the Python allocations with tracemalloc
+    :param device_count: how many devices the generated graph has
+    :param identity_count: how many identities the generated graph has
+    :param seed: the seed of the generated graph
+    :param identity_affinity: the identity affinity of the generated graph, see `create_synthetic_graph`
+    :return: a frame with one row per variant
+    """
+    if g is None:
+        g = create_synthetic_graph(device_count, identity_count, seed = seed, identity_affinity = identity_affinity)
+    if variants is None:
+        variants = default_variants
+    rows = []
+    quiet = instrumentation.quiet
+    instrumentation.quiet = True
+    try:
+        for name, settings in variants.items():
+            (predictions, ids), record = measure(name, g.number_of_nodes(), trace_memory, infer_identities, g, threshold, False, max_predictions, **settings)
+            row = {"variant": name, "seconds": record["seconds"], "peak_traced_bytes": record.get("peak_traced_bytes")}
+            row.update(evaluate_predictions(g, predictions))
+            rows.append(row)
+    finally:
+        instrumentation.quiet = quiet
+    return pd.DataFrame(rows)
+
+
+def pareto_front(frame, cost = "seconds", quality = "f1"):
+    """
+    Returns the variants which no other variant beats on both cost and quality.
+
+    :param frame: a frame from `evaluate_variants`
+    :param cost: the column to minimise
+    :param quality: the column to maximise
+    :return: the rows of the front, sorted by increasing cost
+    """
+    ordered = frame.sort_values(by = [cost, quality], ascending = [True, False])
+    keep = []
+    best = None
+    for index, row in ordered.iterrows():
+        if best is None or row[quality] > best:
+            keep.append(index)
+            best = row[quality]
+    return ordered.loc[keep]
@@ -0,0 +1,159 @@
+import networkx as nx
+
+from .data import normalize_entity_id
+from .inference import infer_component
+
+
+class IncrementalResolver(object):
+    """
+    Keeps the identity predictions up to date while batches of entities arrive.
+    The per-device attribute sets and the overlap counts of device couples are maintained as edges are added,
+    so only the components touched by a batch are coupled again, without any Jaccard recomputation.
+    """
+
+    attribute_labels = ["IP", "Location", "Identity", "Cookie"]
+    """The entity keys linked to a device."""
+
+    def __init__(self, threshold = 0.1, max_hops = None):
+        """
+        :param threshold: predictions with a probability below this number will be ignored
+        :param max_hops: if specified, couplings along paths with more edges are not considered
+        """
+        self.threshold = threshold
+        self.max_hops = max_hops
+        self.graph = nx.DiGraph()
+        self.node_indices = {}
+        self.attributes = {}
+        self.devices = {}
+        self.overlaps = {}
+        self.predictions = {}
+
+    def get_node(self, label, id):
+        """
+        Returns the node with the given label and id, if it exists.
+
+        :param label: the node label
+        :param id: the entity id
+        :return: the node index or None
+        """
+        id = normalize_entity_id(id)
+        if id is None:
+            return None
+        return self.node_indices.get((label, id))
+
+    def _add_node(self, label, id):
+        id = normalize_entity_id(id)
+        if id is None:
+            return None
+        key = (label, id)
+        if key not in self.node_indices:
+            i = len(self.graph.nodes())
+            self.graph.add_node(i, label = label, id = id)
+            self.node_indices[key] = i
+            if label == "Device":
+                self.attributes[i] = set()
+            else:
+                self.devices[i] = set()
+        return self.node_indices[key]
+
+    def _link(self, device, attribute, label):
+        if self.graph.has_edge(device, attribute):
+            return
+        self.graph.add_edge(device, attribute, label = "HAS_" + str.upper(label))
+        for other in self.devices[attribute]:
+            couple = (device, other) if device < other else (other, device)
+            self.overlaps[couple] = self.overlaps.get(couple, 0) + 1
+        self.devices[attribute].add(device)
+        self.attributes[device].add(attribute)
+
+    def similarity(self, u, v):
+        """
+        Returns the Jaccard similarity of two devices from the maintained overlap counts.
+
+        :param u: a device node
+        :param v: another device node
+        :return: the similarity
+        """
+        shared = self.overlaps.get((u, v) if u < v else (v, u), 0)
+        if shared == 0:
+            return 0.0
+        return shared / (len(self.attributes[u]) + len(self.attributes[v]) - shared)
+
+    def add_entities(self, entities):
+        """
+        Adds a batch of entities, in the format of `transform_raw_line_to_entity`, and updates the predictions.
+        A record which is not an entity raises a ValueError, the records before it are kept and their components refreshed.
+
+        :param entities: an iterable of entity dictionaries
+        :return: a dictionary with the 'added', 'changed' and 'removed' (device id, identity id, probability) triples
+        """
+        touched = set()
+        try:
+            for r in entities:
+                self.check_entity(r)
+                device = self._add_node("Device", r.get("Device"))
+                if device is None:
+                    continue
+                touched.add(device)
+                for label in self.attribute_labels:
+                    attribute = self._add_node(label, r.get(label))
+                    if attribute is not None:
+                        self._link(device, attribute, label)
+        finally:
+            delta = self._refresh(touched)
+        return delta
+
+    def check_entity(self, r):
+        """
+        Raises a ValueError if the given record is not an entity: a dictionary whose ids are strings, numbers or None.
+
+        :param r: a record
+        """
+        if not isinstance(r, dict):
+            raise ValueError(f"An entity should be a dictionary, not {type(r).__name__}.")
+        for label in ["Device"] + self.attribute_labels:
+            value = r.get(label)
+            if value is not None and not isinstance(value, (str, int, float)):
+                raise ValueError(f"The {label} of an entity should be a string or a number, not {type(value).__name__}.")
+
+    def _refresh(self, touched):
+        g = self.graph.to_undirected(as_view = True)
+        delta = {"added": [], "changed": [], "removed": []}
+        seen = set()
+        for device in touched:
+            if device in seen:
+                continue
+            component = nx.node_connected_component(g, device)
+            seen.update(component)
+            devices = [u for u in component if u in self.attributes]
+            similarities = {}
+            for u in devices:
+                for a in self.attributes[u]:
+                    for v in self.devices[a]:
+                        if u < v:
+                            similarities[(u, v)] = self.similarity(u, v)
+            old = {}
+            for u in devices:
+                old.update({(u, i): p for i, p in self.predictions.pop(u, {}).items()})
+            found = infer_component(nx.Graph(g.subgraph(component)), self.threshold, None, self.max_hops, similarities)
+            for u, i, p in found:
+                self.predictions.setdefault(u, {})[i] = p
+                if (u, i) not in old:
+                    delta["added"].append(self._to_ids(u, i, p))
+                elif old[(u, i)] != p:
+                    delta["changed"].append(self._to_ids(u, i, p))
+            for (u, i), p in old.items():
+                if i not in self.predictions.get(u, {}):
+                    delta["removed"].append(self._to_ids(u, i, p))
+        return delta
+
+    def _to_ids(self, u, v, p):
+        return self.graph.nodes[u]["id"], self.graph.nodes[v]["id"], p
+
+    def get_predictions(self):
+        """
+        Returns all the current predictions.
+
+        :return: an array of (device id, identity id, probability) triples
+        """
+        return [self._to_ids(u, i, p) for u in self.predictions for i, p in self.predictions[u].items()]
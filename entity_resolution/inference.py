@@ -1,61 +1,172 @@
 import networkx as nx
-from tqdm import tqdm
 import time
+import heapq
 
 from datetime import timedelta
 
+from .sparse import infer_sparse_identities
+from .lsh import infer_minhash_identities
+from .ranking import push_prediction, heap_floor, sorted_predictions
+from .unionfind import UnionFind
+from .similarity import get_kernel, jaccard_kernel, component_similarities
+from .cache import ComponentCache, component_fingerprint, node_key
+from .checkpoint import Checkpoint
+from .data import normalize_entity_id, graph_fingerprint
+from .instrumentation import instrumentation, instrumented, span, count, log, progress
+
+
+def get_candidate_pairs(h, devices, supernodes = None):
+    """
+    Returns the device couples sharing at least one attribute (Cookie, IP, Location or Identity).
+    The couples are found via an attribute-to-devices inverted index so the cost grows
+    with the amount of actual overlaps rather than with the square of the device count.
+    Couples which are not returned have a Jaccard similarity of zero.
+
+    :param h: an undirected graph
+    :param devices: the device nodes to consider
+    :param supernodes: attribute nodes which should not generate couples, see `get_supernode_weights`
+    :return: the (u, v) couples with u < v, in the order of the given devices
+    """
+    position = {u: k for k, u in enumerate(devices)}
+    index = {}
+    for u in devices:
+        for a in h.neighbors(u):
+            if a not in position and (supernodes is None or a not in supernodes):
+                index.setdefault(a, []).append(u)
+    couples = set()
+    for members in index.values():
+        for k, u in enumerate(members):
+            for v in members[k + 1:]:
+                couples.add((u, v) if u < v else (v, u))
+    return sorted(couples, key = lambda e: (position[e[0]], position[e[1]]))
+
+
+def find_supernodes(g, max_degree):
+    """
+    Returns the Cookie, IP and Location nodes linked to more devices than allowed,
+    like a carrier-grade NAT IP or a large city.
+
+    :param g: a graph
+    :param max_degree: the maximum amount of devices of an attribute, either a number for all attribute labels or a dictionary label -> number where missing labels are not capped
+    :return: a dictionary node -> degree
+    """
+    if max_degree is None:
+        return {}
+    found = {}
+    for u in g.nodes():
+        label = g.nodes[u]["label"]
+        if label not in ["IP", "Location", "Cookie"]:
+            continue
+        cap = max_degree.get(label) if isinstance(max_degree, dict) else max_degree
+        if cap is not None and g.degree(u) > cap:
+            found[u] = g.degree(u)
+    return found
+
+
+def get_supernode_weights(g, max_degree, strategy = "exclude"):
+    """
+    Returns the similarity weights of the supernodes, every other attribute has weight one.
+    Supernodes never generate device couples. With the 'exclude' strategy they are also left out of the similarities,
+    with the 'downweight' strategy they count for the cap divided by their degree (an inverse document frequency).
+
+    :param g: a graph
+    :param max_degree: see `find_supernodes`
+    :param strategy: 'exclude' or 'downweight'
+    :return: a dictionary node -> weight
+    """
+    if strategy not in ["exclude", "downweight"]:
+        raise Exception(f"Unknown supernode strategy '{strategy}'. Only 'exclude' or 'downweight' is supported.")
+    weights = {}
+    for u, degree in find_supernodes(g, max_degree).items():
+        if strategy == "exclude":
+            weights[u] = 0.0
+        else:
+            cap = max_degree.get(g.nodes[u]["label"]) if isinstance(max_degree, dict) else max_degree
+            weights[u] = cap / degree
+    return weights
+
+
+def most_probable_couplings(neighbors, source, threshold = 0.1, max_hops = None):
+    """
+    Best-first (max-product) search from the given node, i.e. Dijkstra on -log(p).
+    A node is not expanded once its coupling drops below the threshold, so the work depends
+    on the threshold rather than on the size of the component.
+    With a hop limit the search state is the (node, hops) couple: a node reached again with fewer hops
+    than any of its earlier visits is expanded again, since a less probable but shorter path can still lead further.
+
+    :param neighbors: a function returning the (node, p) couples adjacent to a node
+    :param source: the node to start from, usually an identity
+    :param threshold: couplings which round below this number are not explored
+    :param max_hops: if specified, paths with more edges are not explored
+    :return: a dictionary node -> (coupling, hops, predecessor) of the most probable path to every node reached, the predecessor being reached through its own most probable path
+    """
+    found = {}
+    # the fewest hops a node was expanded with, a visit with as many hops or more is dominated
+    expanded = {}
+    counter = 0
+    queue = [(-1.0, 0, counter, source, None)]
+    while len(queue) > 0:
+        c, hops, _, u, predecessor = heapq.heappop(queue)
+        if u in expanded and (max_hops is None or expanded[u] <= hops):
+            continue
+        expanded[u] = hops
+        if u not in found:
+            found[u] = (-c, hops, predecessor)
+        if max_hops is not None and hops >= max_hops:
+            continue
+        for v, p in neighbors(u):
+            if v in expanded and (max_hops is None or expanded[v] <= hops + 1):
+                continue
+            coupling = -c * p
+            if round(coupling, 2) < threshold:
+                continue
+            counter += 1
+            heapq.heappush(queue, (-coupling, hops + 1, counter, v, u))
+    return found
+
+
+def get_weighted_neighbors(h):
+    """
+    Returns the neighbors function of `most_probable_couplings` for the given undirected graph.
+    Edges without a 'p' value have probability one.
+
+    :param h: an undirected graph
+    :return: a function node -> iterable of (node, p)
+    """
+    return lambda u: ((v, d.get("p", 1.0)) for v, d in h[u].items())
+
 
 def infer_identity_edges(g):
     """
     Infers new edges between Identity and Device nodes.
-    This does not involve any probability.
+    This does not involve any probability: every device joined to an identity through shared
+    Cookie, IP or Location nodes is inferred to belong to it. The devices are joined with a union-find
+    in near-linear time and the graph is not copied.
 
     :param g:
     :return: the inferred edges
     """
-    print("Cloning")
-    h = g.copy().to_undirected()
-
-    def contract(label: str):
-        print(f"Contracting edges defined by '{label}' nodes.")
-        # remove the non-shared cookies
-        single_i = [u for u in h.nodes() if h.nodes()[u]["label"]
-                    == label and h.degree(u) == 1]
-        h.remove_nodes_from(single_i)
-
-        # contract remaining ones
-        ids = [u for u in h.nodes() if h.nodes()[u]["label"] == label]
-        for i in tqdm(ids):
-            neigh = h.neighbors(i)
-            for u in neigh:
-                for v in neigh:
-                    if u < v:
-                        h.add_edge(u, v, label = "SIMILAR")
-        h.remove_nodes_from(ids)
-
-    contract("Cookie")
-    contract("IP")
-    contract("Location")
-
-    # remove single device
-    single_devices = [u for u in h.nodes() if h.nodes(
-    )[u]["label"] == "Device" and h.degree(u) == 0]
-    h.remove_nodes_from(single_devices)
-
-    identities = [u for u in h.nodes() if h.nodes()[u]["label"] == "Identity"]
+    union_find = get_union_find(g)
+    if union_find is None:
+        union_find = UnionFind(g.nodes())
+        for u, v in g.edges():
+            union_find.union(u, v)
 
-    print("Inferring identities")
+    log("Inferring identities")
     coll = []
-    for i in tqdm(identities):
-        # can only be devices or identity since all the rest has been removed
-        devs = nx.shortest_path(h, i).keys()
-        for j in devs:
-            if i != j and not h.has_edge(i, j) and h.nodes()[j]["label"] != "Identity":
-                h.add_edge(j, i, label = "INFERRED")
-                coll.append((j, i))
+    for members in union_find.groups().values():
+        identities = [u for u in members if g.nodes[u]["label"] == "Identity"]
+        if len(identities) == 0:
+            continue
+        devices = [u for u in members if g.nodes[u]["label"] == "Device"]
+        for i in identities:
+            for j in devices:
+                if not g.has_edge(j, i) and not g.has_edge(i, j):
+                    coll.append((j, i))
     return coll
 
 
+@instrumented("inference")
 def infer_jaccard_identity(h, threshold = 0.1):
     """
     Identity inference with cumulative edge probability based on Jaccard similarity.
@@ -69,14 +180,15 @@ def infer_jaccard_identity(h, threshold = 0.1):
     h = h.to_undirected()
     # add an edge with Jaccard similarity between every couple of device
     devices = [u for u in h.nodes() if h.nodes()[u]["label"] == "Device"]
-    device_couples = [(u, v) for u in devices for v in devices if u < v]
-    print("Computing similarities")
-    jc = {(u, v): p for u, v, p in nx.algorithms.jaccard_coefficient(h, device_couples)}
-    print("Creating similarity edges")
-    for e in tqdm(jc):
+    device_couples = get_candidate_pairs(h, devices)
+    log("Computing similarities")
+    with span("similarity"):
+        jc = {(u, v): p for u, v, p in nx.algorithms.jaccard_coefficient(h, device_couples)}
+    log("Creating similarity edges")
+    for e in progress(jc):
         if jc[e] > 0:
             h.add_edge(*e, label = "SIMILAR", p = jc[e])
-    print("Removing unnecessary nodes")
+    log("Removing unnecessary nodes")
     to_remove = [u for u in h.nodes() if h.nodes()[u]["label"] in ["IP", "Location", "Cookie"]]
     h.remove_nodes_from(to_remove)
 
@@ -85,87 +197,415 @@ def infer_jaccard_identity(h, threshold = 0.1):
     h.remove_nodes_from(single_devices)
 
     identities = [u for u in h.nodes() if h.nodes()[u]["label"] == "Identity"]
-    print(f"Inferring {len(identities)} identities")
+    log(f"Inferring {len(identities)} identities")
+    neighbors = get_weighted_neighbors(h)
     coll = []
-    for i in tqdm(identities):
-        shorts = nx.shortest_path(h, source = i)
-        for j in shorts:
-            if i != j and h.nodes(data = True)[j]["label"] == "Device":
-                seq = shorts[j]
-                coupling = 1
-                for k in range(len(seq) - 1):
-                    e = (seq[k], seq[k + 1])
-                    coupling *= h.edges()[e]["p"] if "p" in h.edges()[e] else 1.0
-                coupling = round(coupling, 2)
-                if coupling < threshold:
-                    continue
-                if not h.has_edge(i, j):
-                    h.add_edge(j, i, label = "INFERRED", p = coupling)
-                    coll.append((j, i, {"p": coupling}))
+    for i in progress(identities):
+        with span("path search"):
+            found = most_probable_couplings(neighbors, i, threshold)
+        for j in found:
+            if i != j and h.nodes[j]["label"] == "Device" and not h.has_edge(i, j):
+                coll.append((j, i, {"p": round(found[j][0], 2)}))
 
     return coll
 
 
-def infer_identities(m: nx.DiGraph, threshold = 0.1, return_ids = False, max_predictions = 100):
+@instrumented("inference")
+def infer_identities(m: nx.DiGraph, threshold = 0.1, return_ids = False, max_predictions = 100, engine = "networkx", num_perm = 128, bands = 64, max_hops = None, workers = 1, max_degree = None, supernode_strategy = "exclude", similarity = None, cache = None, work_directory = None, resume_from = None, checkpoint_interval = 60):
     """
     Infers identities on the given graph.
+    The coupling of a device with an identity is the highest product of the similarities along a path between them
+    and the most probable predictions across all components are returned.
 
     :param m: the graph
     :param threshold: predictions with a probability below this number will be ignored
     :param return_ids: if False the node numbers will be returned
+    :param max_predictions: the maximum amount of predictions to generate (top N), None for all of them
+    :param engine: 'networkx' (default), 'sparse' to compute the similarities with sparse matrix products or 'minhash' to approximate them with MinHash/LSH
+    :param num_perm: the length of the MinHash signatures, only used by the 'minhash' engine
+    :param bands: the amount of LSH bands, only used by the 'minhash' engine
+    :param max_hops: if specified, couplings along paths with more edges are not considered (networkx engine only)
+    :param workers: the amount of processes the components are spread over (networkx engine only)
+    :param max_degree: the maximum amount of devices of a Cookie, IP or Location, either a number or a dictionary label -> number, see `find_supernodes`
+    :param supernode_strategy: 'exclude' or 'downweight', how attributes above the maximum degree are handled, see `get_supernode_weights`
+    :param similarity: how devices are scored, 'jaccard' (default), 'adamic_adar', 'resource_allocation', a dictionary label -> weight or a kernel function, see `get_kernel`
+    :param cache: a `ComponentCache` or the directory of one, the results of unchanged components are then read from it (networkx engine with a single worker only)
+    :param work_directory: if specified, the finished components and their predictions are saved there at regular intervals (networkx engine with a single worker only)
+    :param resume_from: the work directory of an interrupted run with the same settings, the run continues from its last finished component and keeps saving there
+    :param checkpoint_interval: the minimum amount of seconds between two saves of the progress
     :return: an array of (u, v, probability) triples
     """
     t = time.process_time()
-    g = m.to_undirected()
-    components = list(nx.connected_components(g))
-    component_sizes = [len(c) for c in sorted(components, key = len, reverse = True)]
-    coll = []
-    print(f"Analyzing {len(components)} component(s). The largest contains {component_sizes[0]} nodes.")
-    for component in tqdm(components):
-        if len(coll) >= max_predictions:
+    kernel = None if similarity is None or similarity == "jaccard" else get_kernel(similarity)
+    weights = get_supernode_weights(m, max_degree, supernode_strategy)
+    if len(weights) > 0:
+        counts = {}
+        for u in weights:
+            counts[m.nodes[u]["label"]] = counts.get(m.nodes[u]["label"], 0) + 1
+        log(f"Treating {len(weights)} node(s) as supernodes ({supernode_strategy}):", ", ".join(f"{label} {count}" for label, count in counts.items()))
+    if max_hops is not None and engine != "networkx":
+        raise Exception(f"The '{engine}' engine does not support a hop limit.")
+    if workers > 1 and engine != "networkx":
+        raise Exception(f"The '{engine}' engine does not support multiple workers.")
+    if cache is not None and (engine != "networkx" or workers > 1):
+        raise Exception("The component cache is only supported by the 'networkx' engine with a single worker.")
+    if isinstance(cache, str):
+        cache = ComponentCache(cache)
+    if resume_from is not None:
+        work_directory = resume_from
+    checkpoint = None
+    if work_directory is not None:
+        if engine != "networkx" or workers > 1:
+            raise Exception("Checkpoints are only supported by the 'networkx' engine with a single worker.")
+        checkpoint = Checkpoint(work_directory, checkpoint_interval)
+        run = {"nodes": m.number_of_nodes(), "edges": m.number_of_edges(), "threshold": threshold, "max_predictions": max_predictions, "max_hops": max_hops,
+               "similarity": __describe_similarity(similarity), "max_degree": max_degree, "supernode_strategy": supernode_strategy}
+        if resume_from is None:
+            checkpoint.settings = run
+        else:
+            log(f"Resuming after {checkpoint.start(run)} finished component(s).")
+    if engine == "networkx" and workers > 1:
+        from .parallel import infer_parallel_identities
+        coll = infer_parallel_identities(m, threshold, max_predictions, max_hops, workers, weights, kernel)
+    elif engine == "networkx":
+        settings = {"threshold": threshold, "max_hops": max_hops, "similarity": __describe_similarity(similarity)}
+        coll = __infer_networkx_identities(m, threshold, max_predictions, max_hops, weights, kernel, cache, settings, checkpoint)
+        if cache is not None:
+            log(f"Component cache: {cache.hits} hit(s), {cache.misses} miss(es).")
+    elif engine == "sparse":
+        coll = infer_sparse_identities(m, threshold, max_predictions, weights, kernel)
+    elif engine == "minhash":
+        coll = infer_minhash_identities(m, threshold, max_predictions, num_perm, bands, weights, kernel)
+    else:
+        raise Exception(f"Unknown engine '{engine}'. Only 'networkx', 'sparse' or 'minhash' is supported.")
+
+    elapsed_time = time.process_time() - t
+    count("predictions", len(coll))
+    log("Predictions", len(coll))
+    log("Timing", timedelta(seconds = round(elapsed_time, 1)))
+    with span("output"):
+        if return_ids:
+            # convert to id's
+            ids = list(map(lambda t: (m.nodes()[t[0]]["id"], m.nodes()[t[1]]["id"], t[2]), coll))
+        else:
+            ids = None
+    return coll, ids
+
+
+def __describe_similarity(similarity):
+    """
+    Returns a JSON-serialisable description of a similarity setting, used in the cache fingerprints.
+    """
+    if similarity is None or isinstance(similarity, str):
+        return similarity or "jaccard"
+    if isinstance(similarity, dict):
+        return sorted(similarity.items())
+    return getattr(similarity, "__module__", "") + "." + getattr(similarity, "__qualname__", repr(similarity))
+
+
+def __infer_networkx_identities(m: nx.DiGraph, threshold = 0.1, max_predictions = 100, max_hops = None, weights = None, kernel = None, cache = None, settings = None, checkpoint = None):
+    """
+    Infers identities component by component with the networkx algorithms.
+    With a maximum amount of predictions, the components are handled from the highest to the lowest rounded upper bound
+    on their couplings, the largest first among equal bounds, so the top predictions fill up early and the search stops
+    once no remaining component can beat them. Without a maximum there is nothing to prune and no bound is computed.
+
+    :param m: the graph
+    :param threshold: predictions with a probability below this number will be ignored
+    :param max_predictions: the maximum amount of predictions to generate, None for all of them
+    :param max_hops: if specified, couplings along paths with more edges are not considered
+    :param weights: the supernode weights, see `get_supernode_weights`
+    :param kernel: the similarity kernel, see `get_kernel`, None for the Jaccard similarity
+    :param cache: a `ComponentCache`, if specified components are looked up by fingerprint before being inferred
+    :param settings: the settings included in the fingerprints
+    :param checkpoint: a `Checkpoint`, if specified its finished components are skipped and the progress is saved
+    :return: an array of (u, v, probability) triples sorted from the most to the least probable
+    """
+    g = m.to_undirected(as_view = True)
+    with span("component split"):
+        components = get_components(m)
+        if max_predictions is None:
+            bounds = None
+            order = sorted(range(len(components)), key = lambda k: len(components[k]), reverse = True)
+        else:
+            # the predictions are rounded, so are the bounds
+            bounds = [round(component_upper_bound(g, c, weights, kernel), 2) for c in components]
+            order = sorted(range(len(components)), key = lambda k: (bounds[k], len(components[k])), reverse = True)
+    heap = []
+    if checkpoint is not None:
+        for prediction in checkpoint.predictions:
+            push_prediction(heap, prediction, max_predictions)
+    skipped = 0
+    log(f"Analyzing {len(components)} component(s). The largest contains {max((len(c) for c in components), default = 0)} nodes.")
+    for position, k in enumerate(progress(order)):
+        if checkpoint is not None and k in checkpoint.done:
+            continue
+        floor = heap_floor(heap, max_predictions)
+        if bounds is not None and (bounds[k] < threshold or (floor is not None and bounds[k] <= floor)):
+            skipped = len(order) - position
             break
-        h = g.subgraph(component).copy()
-        identities = [u for u in h.nodes() if h.nodes()[u]["label"] == "Identity"]
+        started = time.perf_counter()
+        if cache is None:
+            h = nx.Graph(g.subgraph(components[k]))
+            found = infer_component(h, threshold if floor is None else max(threshold, floor), None, max_hops, weights = weights, kernel = kernel)
+        else:
+            found = __infer_cached_component(g, components[k], cache, threshold, max_hops, weights, kernel, settings)
+        for prediction in found:
+            push_prediction(heap, prediction, max_predictions)
+        instrumentation.record_component(len(components[k]), time.perf_counter() - started, len(found))
+        if checkpoint is not None:
+            checkpoint.record(k, heap)
+    if checkpoint is not None:
+        checkpoint.save(heap)
+    count("skipped components", skipped)
+    if skipped > 0:
+        log(f"Skipped {skipped} component(s) which cannot improve the predictions.")
+    return sorted_predictions(heap)
 
-        devices = [u for u in h.nodes() if h.nodes()[u]["label"] == "Device"]
-        # print(f"Component: {len(h.nodes())} nodes, {len(devices)} devices, {len(identities)} identities.")
 
-        device_couples = [(u, v) for u in devices for v in devices if u < v]
-        jc = {(u, v): p for u, v, p in nx.algorithms.jaccard_coefficient(h, device_couples)}
-        for e in jc:
-            if jc[e] > 0:
-                h.add_edge(*e, label = "SIMILAR", p = jc[e])
-        to_remove = [u for u in h.nodes() if h.nodes()[u]["label"] in ["IP", "Location", "Cookie"]]
-        h.remove_nodes_from(to_remove)
+def __infer_cached_component(g, component, cache, threshold, max_hops, weights, kernel, settings):
+    """
+    Infers identities within a component unless its fingerprint is in the cache.
+    Cached results have to be valid in any run, so they are computed with the threshold rather than the current top-N floor.
+    """
+    component_settings = dict(settings)
+    if weights:
+        component_settings["supernodes"] = sorted([node_key(g, u), weights[u]] for u in component if u in weights)
+    key = component_fingerprint(g, component, component_settings)
+    nodes = {node_key(g, u): u for u in component}
+    cached = cache.get(key)
+    if cached is not None:
+        return [(nodes[u], nodes[v], p) for u, v, p in cached]
+    found = infer_component(nx.Graph(g.subgraph(component)), threshold, None, max_hops, weights = weights, kernel = kernel)
+    cache.put(key, [(node_key(g, u), node_key(g, v), p) for u, v, p in found])
+    return found
 
-        # remove single device
-        single_devices = [u for u in h.nodes() if h.nodes()[u]["label"] == "Device" and h.degree(u) == 0]
-        h.remove_nodes_from(single_devices)
 
-        for i in identities:
-            shorts = nx.shortest_path(h, source = i)
-            for j in shorts:
-                if i != j and h.nodes(data = True)[j]["label"] == "Device":
-                    seq = shorts[j]
-                    coupling = 1
-                    for k in range(len(seq) - 1):
-                        e = (seq[k], seq[k + 1])
-                        coupling *= h.edges()[e]["p"] if "p" in h.edges()[e] else 1.0
-                    coupling = round(coupling, 2)
-                    if coupling < threshold:
-                        continue
-                    if not h.has_edge(i, j):
-                        h.add_edge(j, i, label = "INFERRED", p = coupling)
-                        coll.append((j, i, coupling))
-                        if len(coll) >= max_predictions:
-                            break
+def get_union_find(m):
+    """
+    Returns the union-find attached by `entities_json_to_graph` if it still describes the graph.
+    Any change of the nodes or edges afterwards makes it stale, the fingerprint of the graph it covers is compared to detect that.
 
-    elapsed_time = time.process_time() - t
-    print("Predictions", len(coll))
-    print("Timing", timedelta(seconds = round(elapsed_time, 1)))
-    if return_ids:
-        # convert to id's
-        ids = list(map(lambda t: (m.nodes()[t[0]]["id"], m.nodes()[t[1]]["id"], t[2]), coll))
+    :param m: a graph
+    :return: a `UnionFind` or None
+    """
+    union_find = getattr(m, "union_find", None)
+    if union_find is None or len(union_find) != m.number_of_nodes() or getattr(m, "union_find_fingerprint", None) != graph_fingerprint(m):
+        return None
+    return union_find
+
+
+def get_components(m):
+    """
+    Returns the connected components of the given graph.
+    Graphs created by `entities_json_to_graph` carry a union-find with the components,
+    other graphs go through `nx.connected_components` on an undirected view without copying the graph.
+
+    :param m: a graph
+    :return: a list of node sets
+    """
+    union_find = get_union_find(m)
+    if union_find is not None:
+        return [set(c) for c in union_find.groups().values()]
+    return list(nx.connected_components(m.to_undirected(as_view = True)))
+
+
+def component_upper_bound(g, component, weights = None, kernel = None):
+    """
+    Returns an upper bound on the coupling of any prediction within the given component.
+    A coupling is a product of Jaccard similarities and the similarity of two devices sharing an attribute
+    cannot exceed the ratio of their smallest and largest (weighted) degree. An identity shared by several devices
+    leads to couplings of one. Other similarity kernels are only bounded by one.
+
+    :param g: an undirected graph
+    :param component: the nodes of the component
+    :param weights: the supernode weights, see `get_supernode_weights`
+    :param kernel: the similarity kernel, see `get_kernel`, None for the Jaccard similarity
+    :return: a number between zero and one
+    """
+    if kernel is not None and kernel is not jaccard_kernel:
+        return 1.0 if any(g.nodes[u]["label"] == "Identity" for u in component) else 0.0
+    if weights is None:
+        weights = {}
+
+    def degree(v):
+        if len(weights) == 0:
+            return g.degree(v)
+        return sum(weights.get(x, 1.0) for x in g[v])
+
+    has_identity = False
+    bound = 0.0
+    for u in component:
+        label = g.nodes[u]["label"]
+        if label == "Device":
+            continue
+        if label == "Identity":
+            has_identity = True
+            if g.degree(u) > 1:
+                return 1.0
+            continue
+        if weights.get(u, 1.0) == 0:
+            continue
+        degrees = sorted(degree(v) for v in g[u] if g.nodes[v]["label"] == "Device")
+        # the best ratio of a sorted sequence is found between neighbours
+        for k in range(len(degrees) - 1):
+            bound = max(bound, degrees[k] / degrees[k + 1])
+    return bound if has_identity else 0.0
+
+
+def infer_component(h, threshold = 0.1, max_predictions = 100, max_hops = None, similarities = None, weights = None, kernel = None):
+    """
+    Infers identities within a single connected component.
+
+    :param h: an undirected graph of the component, it will be modified
+    :param threshold: predictions with a probability below this number will be ignored
+    :param max_predictions: the maximum amount of predictions to generate, None for all of them
+    :param max_hops: if specified, couplings along paths with more edges are not considered
+    :param similarities: the (u, v) -> p device similarities if already known, otherwise the Jaccard similarities are computed
+    :param weights: the supernode weights, see `get_supernode_weights`
+    :param kernel: the similarity kernel, see `get_kernel`, None for the Jaccard similarity
+    :return: an array of (u, v, probability) triples
+    """
+    coll = []
+    for j, i, c, hops, found in component_couplings(h, threshold, max_hops, similarities, weights, kernel):
+        coll.append((j, i, c))
+        if max_predictions is not None and len(coll) >= max_predictions:
+            break
+    return coll
+
+
+def component_couplings(h, threshold = 0.1, max_hops = None, similarities = None, weights = None, kernel = None):
+    """
+    Yields the couplings of the devices with the identities of a single connected component, see `infer_component`.
+
+    :param h: an undirected graph of the component, it will be modified
+    :param threshold: couplings below this number will be ignored
+    :param max_hops: if specified, couplings along paths with more edges are not considered
+    :param similarities: the (u, v) -> p device similarities if already known, otherwise they are computed
+    :param weights: the supernode weights, see `get_supernode_weights`
+    :param kernel: the similarity kernel, see `get_kernel`, None for the Jaccard similarity
+    :return: an iterator of (device, identity, rounded coupling, hops, search result) where the search result of `most_probable_couplings` allows to retrace the path
+    """
+    identities = [u for u in h.nodes() if h.nodes()[u]["label"] == "Identity"]
+    devices = [u for u in h.nodes() if h.nodes()[u]["label"] == "Device"]
+
+    if similarities is None and (weights or kernel is not None):
+        with span("similarity"):
+            jc = component_similarities(h, kernel, weights)
+    elif similarities is None:
+        with span("pair generation"):
+            device_couples = get_candidate_pairs(h, devices)
+        count("candidate pairs", len(device_couples))
+        with span("similarity"):
+            jc = {(u, v): p for u, v, p in nx.algorithms.jaccard_coefficient(h, device_couples)}
     else:
-        ids = None
-    return coll, ids
+        jc = similarities
+    for e in jc:
+        if jc[e] > 0:
+            h.add_edge(*e, label = "SIMILAR", p = jc[e])
+    to_remove = [u for u in h.nodes() if h.nodes()[u]["label"] in ["IP", "Location", "Cookie"]]
+    h.remove_nodes_from(to_remove)
+
+    # remove single device
+    single_devices = [u for u in h.nodes() if h.nodes()[u]["label"] == "Device" and h.degree(u) == 0]
+    h.remove_nodes_from(single_devices)
+
+    neighbors = get_weighted_neighbors(h)
+    for i in identities:
+        with span("path search"):
+            found = most_probable_couplings(neighbors, i, threshold, max_hops)
+        for j in found:
+            if i != j and h.nodes[j]["label"] == "Device" and not h.has_edge(i, j):
+                yield j, i, round(found[j][0], 2), found[j][1], found
+
+
+def get_node_index(g):
+    """
+    Returns the (label, id) -> node index of the graph.
+    The index is built once and kept as the `node_index` attribute of the graph, it is rebuilt when the amount of nodes changed.
+
+    :param g: a graph
+    :return: a dictionary (label, normalised id) -> node
+    """
+    index = getattr(g, "node_index", None)
+    if index is None or len(index) != g.number_of_nodes():
+        index = {(g.nodes[u]["label"], normalize_entity_id(g.nodes[u]["id"])): u for u in g.nodes()}
+        g.node_index = index
+    return index
+
+
+def get_local_neighbors(g):
+    """
+    Returns the neighbors function of `most_probable_couplings` on the similarity graph of `infer_identities`,
+    computed on demand from the neighbourhood of the node being expanded:
+    a device is linked to its identities with probability one and to the devices sharing an attribute with their Jaccard similarity,
+    an identity is linked to its devices with probability one.
+
+    :param g: a graph
+    :return: a function node -> iterable of (node, p)
+    """
+    h = g.to_undirected(as_view = True)
+    similarities = {}
+
+    def neighbors(u):
+        if h.nodes[u]["label"] != "Device":
+            return [(v, 1.0) for v in h[u] if h.nodes[v]["label"] == "Device"]
+        coll = [(v, 1.0) for v in h[u] if h.nodes[v]["label"] == "Identity"]
+        attributes = set(h[u])
+        for v in {v for a in attributes for v in h[a] if v != u and h.nodes[v]["label"] == "Device"}:
+            couple = (u, v) if u < v else (v, u)
+            if couple not in similarities:
+                others = set(h[v])
+                shared = len(attributes & others)
+                similarities[couple] = shared / (len(attributes) + len(others) - shared)
+            coll.append((v, similarities[couple]))
+        count("candidate pairs", len(coll))
+        return coll
+
+    return neighbors
+
+
+def __resolve(g, label, id, target, threshold, max_hops):
+    """
+    Returns the couplings of the node with the given label and id with the nodes of the target label, see `resolve_device`.
+    """
+    u = get_node_index(g).get((label, normalize_entity_id(id)))
+    if u is None:
+        raise Exception(f"There is no {label} with id '{id}'.")
+    with span("path search"):
+        found = most_probable_couplings(get_local_neighbors(g), u, threshold, max_hops)
+    coll = []
+    for v, (c, hops, predecessor) in found.items():
+        if v != u and g.nodes[v]["label"] == target and not g.has_edge(u, v) and not g.has_edge(v, u):
+            coll.append((g.nodes[v]["id"], round(c, 2)))
+    return sorted(coll, key = lambda t: -t[1])
+
+
+@instrumented("point query")
+def resolve_device(g, device_id, threshold = 0.1, max_hops = None):
+    """
+    Infers the identities of a single device without a pass over the whole graph.
+    The device is found through the id index and the path search only expands the devices whose coupling stays above the threshold,
+    so the cost follows the size of the neighbourhood. The probabilities are those of `infer_identities`.
+
+    :param g: a graph
+    :param device_id: the id of the device
+    :param threshold: predictions with a probability below this number will be ignored
+    :param max_hops: if specified, couplings along paths with more edges are not considered
+    :return: an array of (identity id, probability) couples from the most to the least probable, without the identities already linked
+    """
+    return __resolve(g, "Device", device_id, "Identity", threshold, max_hops)
+
+
+@instrumented("point query")
+def resolve_identity(g, identity_id, threshold = 0.1, max_hops = None):
+    """
+    Infers the devices of a single identity without a pass over the whole graph, see `resolve_device`.
+
+    :param g: a graph
+    :param identity_id: the id of the identity
+    :param threshold: predictions with a probability below this number will be ignored
+    :param max_hops: if specified, couplings along paths with more edges are not considered
+    :return: an array of (device id, probability) couples from the most to the least probable, without the devices already linked
+    """
+    return __resolve(g, "Identity", identity_id, "Device", threshold, max_hops)
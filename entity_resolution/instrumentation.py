@@ -0,0 +1,196 @@
+import functools
+import time
+from contextlib import contextmanager
+
+from tqdm import tqdm
+
+
+class Instrumentation(object):
+    """
+    Collects the timed spans, counters and per-component measurements of a run.
+    A run starts when the outermost `run` block is entered, which clears the previous measurements,
+    and the report is handed to the registered hooks when it ends.
+    """
+
+    max_components = 100000
+    """The maximum amount of component measurements kept per run, the others are only counted."""
+
+    def __init__(self):
+        self.quiet = False
+        self.hooks = []
+        self.depth = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the measurements.
+        """
+        self.spans = {}
+        self.counters = {}
+        self.components = []
+
+    @contextmanager
+    def run(self, name):
+        """
+        Measures a whole run, nested runs are part of the outer one.
+
+        :param name: the name of the span covering the run
+        """
+        if self.depth == 0:
+            self.reset()
+        self.depth += 1
+        try:
+            with self.span(name):
+                yield
+        finally:
+            self.depth -= 1
+            if self.depth == 0:
+                self.publish()
+
+    @contextmanager
+    def span(self, name):
+        """
+        Adds the time spent in the block to the span with the given name.
+
+        :param name: the name of the span, usually a phase like 'parse' or 'path search'
+        """
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t
+            entry = self.spans.get(name)
+            if entry is None:
+                self.spans[name] = [1, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+
+    def count(self, name, amount = 1):
+        """
+        Increments a counter.
+
+        :param name: the name of the counter
+        :param amount: the increment
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_component(self, size, seconds, predictions = 0):
+        """
+        Records the measurements of a single component.
+
+        :param size: the amount of nodes
+        :param seconds: the time spent on it
+        :param predictions: the amount of predictions it produced
+        """
+        self.count("components")
+        if len(self.components) < self.max_components:
+            self.components.append({"size": size, "seconds": seconds, "predictions": predictions})
+
+    def report(self):
+        """
+        Returns the measurements.
+
+        :return: a dictionary with the 'spans' (name -> count and seconds), the 'counters' and the 'components'
+        """
+        return {
+            "spans": {name: {"count": count, "seconds": seconds} for name, (count, seconds) in self.spans.items()},
+            "counters": dict(self.counters),
+            "components": list(self.components)
+        }
+
+    def publish(self):
+        """
+        Hands the report to the registered hooks.
+
+        :return: the report
+        """
+        report = self.report()
+        for hook in self.hooks:
+            hook(report)
+        return report
+
+
+instrumentation = Instrumentation()
+"""The instrumentation used by the package."""
+
+
+def span(name):
+    """
+    Returns a block measuring the named phase, see `Instrumentation.span`.
+    """
+    return instrumentation.span(name)
+
+
+def instrumented(name):
+    """
+    Decorator measuring every call of a function as a run, or as a span of the enclosing run.
+
+    :param name: the name of the span
+    """
+
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with instrumentation.run(name):
+                return f(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def count(name, amount = 1):
+    """
+    Increments the named counter, see `Instrumentation.count`.
+    """
+    instrumentation.count(name, amount)
+
+
+def get_report():
+    """
+    Returns the measurements of the last run as a dictionary, see `Instrumentation.report`.
+    """
+    return instrumentation.report()
+
+
+def add_hook(hook):
+    """
+    Registers a function receiving the report at the end of every run, for instance to export it.
+
+    :param hook: a function accepting the report dictionary
+    """
+    instrumentation.hooks.append(hook)
+
+
+def remove_hook(hook):
+    """
+    Removes a registered hook.
+    """
+    instrumentation.hooks.remove(hook)
+
+
+def set_quiet(quiet = True):
+    """
+    Turns the console output (messages and progress bars) off or on.
+
+    :param quiet: True to silence the package
+    """
+    instrumentation.quiet = quiet
+
+
+def log(*args):
+    """
+    Prints the given values unless the package is quiet.
+    """
+    if not instrumentation.quiet:
+        print(*args)
+
+
+def progress(iterable, **kwargs):
+    """
+    Wraps the iterable in a progress bar unless the package is quiet.
+    """
+    if instrumentation.quiet:
+        return iterable
+    return tqdm(iterable, **kwargs)
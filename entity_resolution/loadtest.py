@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import socket
+import time
+from urllib.parse import quote
+
+from .data import create_synthetic_graph, graph_to_entities_json
+from .incremental import IncrementalResolver
+from .service import ResolutionService, serve
+
+
+def synthetic_service(devices = 10000, seed = 1, threshold = 0.1):
+    """
+    Returns a service loaded with a seeded synthetic graph, together with the ids to query.
+
+    :param devices: the amount of devices, with one identity per five devices
+    :param seed: the seed of the graph
+    :param threshold: predictions with a probability below this number will be ignored
+    :return: (service, device ids, identity ids)
+    """
+    g = create_synthetic_graph(devices, max(devices // 5, 1), seed = seed)
+    resolver = IncrementalResolver(threshold)
+    resolver.add_entities(graph_to_entities_json(g))
+    service = ResolutionService(resolver)
+    ids = {"Device": [], "Identity": []}
+    for u in g.nodes():
+        if g.nodes[u]["label"] in ids:
+            ids[g.nodes[u]["label"]].append(g.nodes[u]["id"])
+    return service, ids["Device"], ids["Identity"]
+
+
+async def __client(host, port, paths, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            method, path, body = random.choice(paths)
+            started = time.perf_counter()
+            writer.write(f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            if status >= 500:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def __load(host, port, paths, concurrency, seconds):
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    await asyncio.gather(*[__client(host, port, paths, deadline, latencies, errors) for k in range(concurrency)])
+    return latencies, errors, time.perf_counter() - started
+
+
+def run_load_test(host = "127.0.0.1", port = 8080, device_ids = (), identity_ids = (), concurrency = 16, seconds = 10, ingest_ratio = 0.01):
+    """
+    Sends resolve and ingest requests to a running service from concurrent keep-alive connections.
+
+    :param host: the host of the service
+    :param port: the port of the service
+    :param device_ids: the device ids to resolve
+    :param identity_ids: the identity ids to resolve
+    :param concurrency: the amount of connections
+    :param seconds: the duration of the test
+    :param ingest_ratio: the share of ingest requests, each adding a new device linked to a known one's identity
+    :return: a dictionary with the amount of 'requests', the 'errors', the 'qps' and the mean, p50 and p99 latencies in milliseconds
+    """
+    paths = [("GET", "/resolve/device/" + quote(str(id), safe = ""), b"") for id in device_ids]
+    paths += [("GET", "/resolve/identity/" + quote(str(id), safe = ""), b"") for id in identity_ids]
+    if ingest_ratio > 0 and len(identity_ids) > 0:
+        # weighted through repetition, random.choice picks uniformly
+        amount = max(1, int(len(paths) * ingest_ratio))
+        for k in range(amount):
+            entity = {"Device": f"load-{k}", "Identity": random.choice(identity_ids)}
+            paths.append(("POST", "/ingest", json.dumps([entity]).encode("utf-8")))
+    if len(paths) == 0:
+        raise Exception("Specify some device or identity ids to query.")
+    latencies, errors, elapsed = asyncio.run(__load(host, port, paths, concurrency, seconds))
+    latencies.sort()
+    if len(latencies) == 0:
+        return {"requests": 0, "errors": len(errors), "qps": 0.0}
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "qps": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 3),
+        "p50_ms": round(1000 * latencies[len(latencies) // 2], 3),
+        "p99_ms": round(1000 * latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))], 3)
+    }
+
+
+def __serve_synthetic(devices, seed, port):
+    service, device_ids, identity_ids = synthetic_service(devices, seed)
+    serve(service, "127.0.0.1", port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Load-tests the resolution service on localhost with a seeded synthetic graph.")
+    parser.add_argument("--port", type = int, default = 8080)
+    parser.add_argument("--devices", type = int, default = 10000, help = "the amount of devices of the synthetic graph")
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--concurrency", type = int, default = 16)
+    parser.add_argument("--seconds", type = float, default = 10)
+    parser.add_argument("--ingest-ratio", type = float, default = 0.01)
+    parser.add_argument("--external", action = "store_true", help = "query a service already started with the same graph instead of starting one")
+    arguments = parser.parse_args()
+    process = None
+    if not arguments.external:
+        process = multiprocessing.Process(target = __serve_synthetic, args = (arguments.devices, arguments.seed, arguments.port), daemon = True)
+        process.start()
+    g = create_synthetic_graph(arguments.devices, max(arguments.devices // 5, 1), seed = arguments.seed)
+    device_ids = [g.nodes[u]["id"] for u in g.nodes() if g.nodes[u]["label"] == "Device"]
+    identity_ids = [g.nodes[u]["id"] for u in g.nodes() if g.nodes[u]["label"] == "Identity"]
+    # wait for the service to listen
+    for attempt in range(600):
+        try:
+            socket.create_connection(("127.0.0.1", arguments.port)).close()
+            break
+        except OSError:
+            time.sleep(0.5)
+    result = run_load_test("127.0.0.1", arguments.port, device_ids, identity_ids, arguments.concurrency, arguments.seconds, arguments.ingest_ratio)
+    print(json.dumps(result, indent = 2))
+    if process is not None:
+        process.terminate()
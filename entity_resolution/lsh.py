@@ -0,0 +1,166 @@
+import time
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from .data import create_synthetic_graph
+from .instrumentation import span, count
+from .sparse import graph_to_incidence, sparse_jaccard, pair_jaccard, couple_identities, attribute_weights
+
+__prime = (1 << 31) - 1
+"""The Mersenne prime used by the universal hash functions."""
+
+
+def minhash_signatures(a, num_perm = 128, seed = 1):
+    """
+    Computes the MinHash signature of the attribute set of every device.
+
+    :param a: the device × attribute incidence matrix (CSR)
+    :param num_perm: the amount of hash functions, i.e. the length of a signature
+    :param seed: the seed of the hash functions
+    :return: a (devices × num_perm) array, devices without attributes get the maximum value everywhere
+    """
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(1, __prime, num_perm, dtype = np.int64)
+    offsets = rng.integers(0, __prime, num_perm, dtype = np.int64)
+    signatures = np.full((a.shape[0], num_perm), __prime, dtype = np.int64)
+    filled = np.flatnonzero(np.diff(a.indptr) > 0)
+    if len(filled) == 0:
+        return signatures
+    starts = a.indptr[filled]
+    columns = a.indices.astype(np.int64)
+    for k in range(num_perm):
+        hashes = (multipliers[k] * columns + offsets[k]) % __prime
+        signatures[filled, k] = np.minimum.reduceat(hashes, starts)
+    return signatures
+
+
+def lsh_candidate_pairs(signatures, bands = 64, seed = 1):
+    """
+    Returns the device couples which agree on all the rows of at least one band of their signatures.
+    Two devices with Jaccard similarity s become candidates with probability 1 - (1 - s^r)^b
+    where b is the amount of bands and r the amount of rows per band.
+
+    :param signatures: the MinHash signatures
+    :param bands: the amount of bands, should divide the signature length
+    :param seed: the seed used to combine the rows of a band into a bucket key
+    :return: (row indices, column indices) with row < column
+    """
+    device_count, num_perm = signatures.shape
+    if num_perm % bands != 0:
+        raise Exception(f"The amount of bands ({bands}) should divide the signature length ({num_perm}).")
+    rows_per_band = num_perm // bands
+    # devices without any attribute have a constant signature and should never collide
+    filled = np.flatnonzero((signatures != __prime).any(axis = 1))
+    weights = np.random.default_rng(seed).integers(1, 1 << 62, rows_per_band, dtype = np.int64) | 1
+    found = []
+    for b in range(bands):
+        band = signatures[filled, b * rows_per_band:(b + 1) * rows_per_band].astype(np.uint64)
+        # wrapping arithmetic is fine for a bucket key, collisions are removed by the exact score
+        keys = band @ weights.astype(np.uint64)
+        order = np.argsort(keys, kind = "stable")
+        members = filled[order]
+        starts = np.flatnonzero(np.concatenate([[True], np.diff(keys[order]) != 0]))
+        sizes = np.diff(np.append(starts, len(order)))
+        # the buckets of two are by far the most common and are handled in one go
+        pairs = starts[sizes == 2]
+        u, v = np.minimum(members[pairs], members[pairs + 1]), np.maximum(members[pairs], members[pairs + 1])
+        found.append(u * device_count + v)
+        for start, size in zip(starts[sizes > 2], sizes[sizes > 2]):
+            bucket = np.sort(members[start:start + size])
+            u, v = np.triu_indices(size, k = 1)
+            found.append(bucket[u] * device_count + bucket[v])
+    if len(found) == 0:
+        return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)
+    codes = np.unique(np.concatenate(found))
+    return codes // device_count, codes % device_count
+
+
+def minhash_jaccard(a, floor = 0.1, num_perm = 128, bands = 64, seed = 1, w = None, kernel = None, labels = None):
+    """
+    Approximates the device similarities: the candidates are found with MinHash/LSH
+    and only those get an exact Jaccard score.
+
+    :param a: the device × attribute incidence matrix
+    :param floor: candidates with a similarity rounding below this number are dropped
+    :param num_perm: the length of the MinHash signatures
+    :param bands: the amount of LSH bands
+    :param seed: the seed of the hash functions
+    :param w: the column weights, see `attribute_weights`, the supernode columns are left out of the signatures
+    :param kernel: the similarity kernel scoring the candidates, see `get_kernel`, None for the Jaccard similarity
+    :param labels: the label of every attribute, passed to the kernel
+    :return: (row indices, column indices, similarities) with row < column
+    """
+    with span("pair generation"):
+        signatures = minhash_signatures(a if w is None else a[:, np.flatnonzero(w >= 1)], num_perm, seed)
+        rows, cols = lsh_candidate_pairs(signatures, bands, seed)
+    count("candidate pairs", len(rows))
+    with span("similarity"):
+        p = pair_jaccard(a, rows, cols, w) if kernel is None else kernel(a, rows, cols, w, labels)
+    # the predictions are rounded, so are the similarities compared with the floor
+    keep = np.round(p, 2) >= floor
+    return rows[keep], cols[keep], p[keep]
+
+
+def infer_minhash_identities(m: nx.DiGraph, threshold = 0.1, max_predictions = 100, num_perm = 128, bands = 64, weights = None, kernel = None):
+    """
+    Infers identities with approximate similarities, see `minhash_jaccard`.
+    This is the 'minhash' engine of `infer_identities`, meant for components too large for exact Jaccard.
+    Since a coupling is a product of similarities, couples below the threshold can never contribute
+    and the threshold is used as the similarity floor.
+
+    :param m: the graph
+    :param threshold: predictions with a probability below this number will be ignored
+    :param max_predictions: the maximum amount of predictions to generate (top N), None for all of them
+    :param num_perm: the length of the MinHash signatures
+    :param bands: the amount of LSH bands
+    :param weights: the supernode weights, see `get_supernode_weights`
+    :param kernel: the similarity kernel, see `get_kernel`, None for the Jaccard similarity
+    :return: an array of (u, v, probability) triples sorted from the most to the least probable
+    """
+    a, devices, attributes = graph_to_incidence(m)
+    labels = [m.nodes[u]["label"] for u in attributes]
+    rows, cols, p = minhash_jaccard(a, threshold, num_perm, bands, w = attribute_weights(attributes, weights), kernel = kernel, labels = labels)
+    with span("path search"):
+        return couple_identities(m, a, devices, attributes, rows, cols, p, threshold, max_predictions)
+
+
+def minhash_report(device_count = 5000, identity_count = 1000, settings = ((64, 32), (128, 32), (128, 64), (128, 128), (256, 64)), threshold = 0.1, cookie_probability = 0.3, ip_probability = 0.3, location_probability = 0.3):
+    """
+    Compares the MinHash/LSH similarities against the exact `jaccard_coefficient` path on a synthetic graph.
+    The recall is the fraction of device couples with an exact similarity of at least the threshold
+    which are also found by the approximation.
+
+    :param device_count: how many devices to create
+    :param identity_count: how many identities to create
+    :param settings: the (num_perm, bands) combinations to try, the 'LSH threshold' column is the similarity (1/b)^(1/r) around which couples start to be found
+    :param threshold: the similarity floor
+    :param cookie_probability: the probability that a cookie is shared
+    :param ip_probability: the probability that an IP node is shared
+    :param location_probability: the probability that a Location node is shared
+    :return: a Pandas frame with one row per setting
+    """
+    from .inference import get_candidate_pairs
+    g = create_synthetic_graph(device_count, identity_count, cookie_probability, ip_probability, location_probability)
+    h = g.to_undirected()
+    devices = [u for u in h.nodes() if h.nodes()[u]["label"] == "Device"]
+    t = time.perf_counter()
+    couples = get_candidate_pairs(h, devices)
+    exact = {(u, v) if u < v else (v, u) for u, v, p in nx.algorithms.jaccard_coefficient(h, couples) if round(p, 2) >= threshold}
+    exact_seconds = time.perf_counter() - t
+
+    a, devices, attributes = graph_to_incidence(g)
+    t = time.perf_counter()
+    sparse_jaccard(a)
+    sparse_seconds = time.perf_counter() - t
+
+    coll = []
+    for num_perm, bands in settings:
+        t = time.perf_counter()
+        rows_found, cols_found, p = minhash_jaccard(a, threshold, num_perm, bands)
+        seconds = time.perf_counter() - t
+        found = {(min(devices[u], devices[v]), max(devices[u], devices[v])) for u, v in zip(rows_found, cols_found)}
+        recall = len(found & exact) / len(exact) if len(exact) > 0 else 1.0
+        coll.append((num_perm, bands, num_perm // bands, round((1 / bands) ** (bands / num_perm), 3), recall, seconds, exact_seconds, sparse_seconds))
+    return pd.DataFrame(coll, columns = ["Permutations", "Bands", "Rows", "LSH threshold", "Recall", "Seconds", "Exact seconds", "Sparse seconds"])
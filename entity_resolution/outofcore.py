@@ -0,0 +1,306 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import networkx as nx
+import numpy as np
+
+from .data import iter_raw_entities, normalize_entity_id
+from .inference import infer_component, component_upper_bound
+from .instrumentation import instrumented, span, count, log, progress
+from .ranking import push_prediction, heap_floor, sorted_predictions
+
+label_codes = {"Device": 0, "IP": 1, "Location": 2, "Identity": 3, "Cookie": 4}
+"""The label stored in the three lowest bits of a node code."""
+
+label_names = {code: label for label, code in label_codes.items()}
+
+__label_bits = np.uint64(7)
+
+
+def node_code(label, id):
+    """
+    Returns the 64-bit code of an entity: a hash of its normalised id with the label code in the lowest three bits.
+    Codes replace an in-memory id dictionary, collisions are negligible below billions of entities.
+
+    :param label: the node label
+    :param id: the normalised entity id
+    :return: an unsigned integer
+    """
+    digest = int.from_bytes(hashlib.blake2b(f"{label}\t{id}".encode("utf-8"), digest_size = 8).digest(), "little")
+    return (digest & ~7) | label_codes[label]
+
+
+def __append(path, array):
+    with open(path, "ab") as f:
+        array.tofile(f)
+
+
+def write_edge_pairs(entities, work_directory, chunk_size = 1000000, partitions = 16):
+    """
+    Writes the (device, attribute) edges of the given entities to disk as pairs of node codes.
+    The node codes are also written to `partitions` files by their highest bits and the ids to a text file,
+    both deduplicated per chunk only.
+
+    :param entities: an iterable of entities, see `transform_raw_line_to_entity`
+    :param work_directory: the directory receiving the files
+    :param chunk_size: how many edges are buffered before being written
+    :param partitions: the amount of node partitions, a power of two
+    :return: the amount of edges written
+    """
+    shift = np.uint64(64 - int(np.log2(partitions)))
+    edges = []
+    ids = {}
+    total = 0
+
+    def flush():
+        pairs = np.array(edges, dtype = np.uint64).reshape(-1, 2)
+        __append(os.path.join(work_directory, "edges.bin"), pairs)
+        codes = np.unique(pairs)
+        part = codes >> shift
+        for k in np.unique(part):
+            __append(os.path.join(work_directory, f"nodes-{k}.bin"), codes[part == k])
+        with open(os.path.join(work_directory, "ids.tsv"), "a", encoding = "utf-8") as f:
+            f.writelines(f"{code}\t{id}\n" for code, id in ids.items())
+        edges.clear()
+        ids.clear()
+
+    for r in entities:
+        device = normalize_entity_id(r.get("Device"))
+        if device is None:
+            continue
+        u = node_code("Device", device)
+        ids[u] = device
+        for label in ["IP", "Location", "Identity", "Cookie"]:
+            id = normalize_entity_id(r.get(label))
+            if id is None:
+                continue
+            v = node_code(label, id)
+            ids[v] = id
+            edges.extend((u, v))
+            total += 1
+        if len(edges) >= 2 * chunk_size:
+            flush()
+    flush()
+    return total
+
+
+def __memmap(work_directory, name, dtype, mode = "r", shape = None):
+    return np.memmap(os.path.join(work_directory, name), dtype = dtype, mode = mode, shape = shape)
+
+
+def __chunks(array, chunk_size):
+    for start in range(0, len(array), chunk_size):
+        yield start, array[start:start + chunk_size]
+
+
+def __merge_runs(runs, f, chunk_size):
+    """
+    Writes the distinct codes of the given sorted run files to the open file, holding one chunk per run at a time.
+    """
+    arrays = [np.memmap(run, dtype = np.uint64, mode = "r") for run in runs]
+    positions = [0] * len(arrays)
+    last = None
+    total = 0
+    while any(position < len(a) for position, a in zip(positions, arrays)):
+        blocks = [(k, a[positions[k]:positions[k] + chunk_size]) for k, a in enumerate(arrays) if positions[k] < len(a)]
+        # everything up to the smallest block end is known to be complete
+        cut = min(block[-1] for k, block in blocks)
+        taken = []
+        for k, block in blocks:
+            end = int(np.searchsorted(block, cut, side = "right"))
+            taken.append(block[:end])
+            positions[k] += end
+        merged = np.unique(np.concatenate(taken))
+        if last is not None and merged[0] == last:
+            merged = merged[1:]
+        merged.tofile(f)
+        total += len(merged)
+        last = merged[-1] if len(merged) > 0 else last
+    return total
+
+
+def intern_nodes(work_directory, partitions = 16, chunk_size = 1000000):
+    """
+    Merges the node partitions into one sorted array of distinct codes, the position in it being the node index.
+    Since the partitions follow the highest bits, sorting every partition on its own sorts the whole.
+    A partition larger than the chunk size is sorted in runs of that size which are then merged chunk by chunk.
+
+    :param work_directory: the directory with the files of `write_edge_pairs`
+    :param partitions: the amount of node partitions
+    :param chunk_size: how many codes are sorted at once
+    :return: the amount of nodes
+    """
+    total = 0
+    with open(os.path.join(work_directory, "nodes.bin"), "wb") as f:
+        for k in range(partitions):
+            path = os.path.join(work_directory, f"nodes-{k}.bin")
+            if not os.path.exists(path):
+                continue
+            codes = __memmap(work_directory, f"nodes-{k}.bin", np.uint64)
+            if len(codes) <= chunk_size:
+                unique = np.unique(codes)
+                unique.tofile(f)
+                total += len(unique)
+            else:
+                runs = []
+                for start, chunk in __chunks(codes, chunk_size):
+                    run = os.path.join(work_directory, f"nodes-{k}-{len(runs)}.bin")
+                    np.unique(chunk).tofile(run)
+                    runs.append(run)
+                total += __merge_runs(runs, f, chunk_size)
+                for run in runs:
+                    os.remove(run)
+            del codes
+            os.remove(path)
+    return total
+
+
+def label_components(work_directory, chunk_size = 1000000):
+    """
+    Finds the connected components by streaming the edges: every node takes the smallest label of its neighbours
+    and the labels are shortcut by pointer jumping until a pass changes nothing.
+    The edges are first rewritten as node indices.
+
+    :param work_directory: the directory with the files of `intern_nodes`
+    :param chunk_size: how many edges or nodes are handled at once
+    :return: the memory-mapped component label of every node
+    """
+    nodes = __memmap(work_directory, "nodes.bin", np.uint64)
+    codes = __memmap(work_directory, "edges.bin", np.uint64)
+    with open(os.path.join(work_directory, "pairs.bin"), "wb") as f:
+        for start, chunk in __chunks(codes, 2 * chunk_size):
+            np.searchsorted(nodes, chunk).astype(np.int64).tofile(f)
+    del codes
+    os.remove(os.path.join(work_directory, "edges.bin"))
+
+    pairs = __memmap(work_directory, "pairs.bin", np.int64)
+    labels = __memmap(work_directory, "labels.bin", np.int64, "w+", (len(nodes),))
+    labels[:] = np.arange(len(nodes))
+    changed = True
+    passes = 0
+    while changed:
+        changed = False
+        passes += 1
+        for start, chunk in __chunks(pairs, 2 * chunk_size):
+            u, v = chunk[0::2], chunk[1::2]
+            smallest = np.minimum(labels[u], labels[v])
+            if np.any(labels[u] != smallest) or np.any(labels[v] != smallest):
+                changed = True
+                np.minimum.at(labels, u, smallest)
+                np.minimum.at(labels, v, smallest)
+        # a label always points to a node with a smaller or equal label
+        for start, chunk in __chunks(labels, chunk_size):
+            jumped = labels[chunk]
+            while np.any(jumped != chunk):
+                chunk = jumped
+                jumped = labels[chunk]
+            labels[start:start + len(chunk)] = chunk
+    count("component passes", passes)
+    labels.flush()
+    return labels
+
+
+def partition_components(work_directory, labels, buckets):
+    """
+    Spreads the edges over bucket files so that all the edges of a component land in the same bucket.
+
+    :param work_directory: the directory with the files of `label_components`
+    :param labels: the component label of every node
+    :param buckets: the amount of buckets
+    """
+    pairs = __memmap(work_directory, "pairs.bin", np.int64)
+    for start, chunk in __chunks(pairs, 2 * max(1, len(pairs) // (2 * buckets) + 1)):
+        chunk = chunk.reshape(-1, 2)
+        bucket = labels[chunk[:, 0]] % buckets
+        for k in np.unique(bucket):
+            __append(os.path.join(work_directory, f"bucket-{k}.bin"), chunk[bucket == k])
+
+
+def __resolve_ids(work_directory, codes):
+    """
+    Returns the ids of the given node codes by streaming the id file, only the wanted codes are held in memory.
+    """
+    wanted = set(int(c) for c in codes)
+    found = {}
+    with open(os.path.join(work_directory, "ids.tsv"), "r", encoding = "utf-8") as f:
+        for line in f:
+            code, id = line.rstrip("\n").split("\t", 1)
+            code = int(code)
+            if code in wanted:
+                found[code] = id
+    return found
+
+
+@instrumented("out-of-core inference")
+def infer_out_of_core(raw_directory, work_directory = None, threshold = 0.1, max_predictions = 100, max_hops = None, chunk_size = 1000000, partitions = 16):
+    """
+    Infers identities from the raw gzip files without holding the whole graph in memory.
+    The edges are streamed to disk as interned node codes, the components are labelled by streaming passes over them
+    and the edges are partitioned so that one component is loaded and inferred at a time.
+    The peak memory follows the largest bucket of components, the chunk size and the amount of predictions
+    rather than the size of the data: oversized node partitions are sorted in runs of the chunk size and merged
+    with one chunk per run in memory. The memory-mapped arrays of 8 bytes per node are paged in by the operating system.
+
+    :param raw_directory: the directory containing the gzip files
+    :param work_directory: the directory for the intermediate files, by default a temporary one which is removed afterwards
+    :param threshold: predictions with a probability below this number will be ignored
+    :param max_predictions: the maximum amount of predictions to generate (top N), None for all of them
+    :param max_hops: if specified, couplings along paths with more edges are not considered
+    :param chunk_size: how many edges are handled at once, also the target size of a bucket
+    :param partitions: the amount of node partitions used to sort the codes, a power of two
+    :return: an array of (device id, identity id, probability) triples sorted from the most to the least probable
+    """
+    temporary = work_directory is None
+    if temporary:
+        work_directory = tempfile.mkdtemp()
+    else:
+        os.makedirs(work_directory, exist_ok = True)
+    try:
+        with span("parse"):
+            edge_count = write_edge_pairs(iter_raw_entities(raw_directory), work_directory, chunk_size, partitions)
+        with span("graph build"):
+            node_count = intern_nodes(work_directory, partitions, chunk_size)
+        count("edges", edge_count)
+        count("nodes", node_count)
+        with span("component split"):
+            labels = label_components(work_directory, chunk_size)
+            buckets = max(1, -(-edge_count // chunk_size))
+            partition_components(work_directory, labels, buckets)
+        log(f"Inferring {node_count} nodes and {edge_count} edges in {buckets} bucket(s).")
+
+        nodes = __memmap(work_directory, "nodes.bin", np.uint64)
+        heap = []
+        for k in progress(range(buckets)):
+            path = os.path.join(work_directory, f"bucket-{k}.bin")
+            if not os.path.exists(path):
+                continue
+            pairs = np.fromfile(path, dtype = np.int64).reshape(-1, 2)
+            component = labels[pairs[:, 0]]
+            order = np.argsort(component, kind = "stable")
+            pairs, component = pairs[order], component[order]
+            for group in np.split(pairs, np.flatnonzero(np.diff(component)) + 1):
+                h = nx.Graph()
+                members = np.unique(group)
+                for u, code in zip(members.tolist(), nodes[members] & __label_bits):
+                    h.add_node(u, label = label_names[int(code)])
+                h.add_edges_from(group.tolist())
+                bound = round(component_upper_bound(h, members.tolist()), 2)
+                floor = heap_floor(heap, max_predictions)
+                if bound < threshold or (floor is not None and bound <= floor):
+                    continue
+                for prediction in infer_component(h, threshold if floor is None else max(threshold, floor), None, max_hops):
+                    push_prediction(heap, prediction, max_predictions)
+            os.remove(path)
+        del labels
+
+        coll = sorted_predictions(heap)
+        with span("output"):
+            codes = {u: int(nodes[u]) for prediction in coll for u in prediction[:2]}
+            ids = __resolve_ids(work_directory, codes.values())
+        count("predictions", len(coll))
+        return [(ids[codes[u]], ids[codes[v]], p) for u, v, p in coll]
+    finally:
+        if temporary:
+            shutil.rmtree(work_directory, ignore_errors = True)
@@ -0,0 +1,133 @@
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+
+from .compact import CompactGraph
+from .inference import infer_component, component_upper_bound
+from .ranking import push_prediction, heap_floor, sorted_predictions
+from .instrumentation import instrumentation, span, count, log, progress
+
+__shared = {}
+"""The arrays a worker process attached to, set by the pool initializer."""
+
+
+def __share(array):
+    """
+    Copies the given array into a new shared memory block.
+
+    :param array: a numpy array
+    :return: (shared memory, (name, shape, dtype)) where the tuple allows a worker to attach
+    """
+    block = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype = array.dtype, buffer = block.buf)[:] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def __attach(labels, specs, floor, threshold, max_hops, weights, kernel):
+    """
+    Pool initializer attaching the shared graph arrays and the shared top-N floor in a worker process.
+    """
+    blocks = [shared_memory.SharedMemory(name = name) for name, shape, dtype in specs]
+    __shared["blocks"] = blocks
+    __shared["arrays"] = [np.ndarray(shape, dtype = dtype, buffer = block.buf) for block, (name, shape, dtype) in zip(blocks, specs)]
+    __shared["labels"] = labels
+    __shared["floor"] = floor
+    __shared["settings"] = (threshold, max_hops, weights, kernel)
+
+
+def __infer_shared_component(positions):
+    """
+    Rebuilds the component with the given node positions from the shared arrays and infers its identities,
+    unless the upper bound on its couplings cannot beat the current top predictions.
+
+    :param positions: the sorted positions of the nodes in the component
+    :return: (an array of (u, v, probability) triples in terms of positions, the seconds it took, whether it was skipped)
+    """
+    started = time.perf_counter()
+    codes, indptr, indices = __shared["arrays"]
+    labels = __shared["labels"]
+    threshold, max_hops, weights, kernel = __shared["settings"]
+    h = nx.Graph()
+    for u in positions:
+        h.add_node(int(u), label = labels[codes[u]])
+    for u in positions:
+        for v in indices[indptr[u]:indptr[u + 1]]:
+            if u < v:
+                h.add_edge(int(u), int(v))
+    # the floor only grows, an outdated value merely prunes less
+    floor = __shared["floor"].value
+    bound = round(component_upper_bound(h, h.nodes(), weights, kernel), 2)
+    if bound < threshold or (floor >= 0 and bound <= floor):
+        return [], time.perf_counter() - started, True
+    found = infer_component(h, max(threshold, floor), None, max_hops, weights = weights, kernel = kernel)
+    return found, time.perf_counter() - started, False
+
+
+def infer_parallel_identities(m: nx.DiGraph, threshold = 0.1, max_predictions = 100, max_hops = None, workers = None, weights = None, kernel = None):
+    """
+    Infers identities with a pool of processes, one component at a time per process.
+    The arrays of the `CompactGraph` are placed in shared memory so the workers only receive the node positions of a component.
+    The components are handed out from the largest to the smallest so that the slowest ones do not come last.
+    Every worker computes the upper bound on the couplings of its component and skips it if it cannot beat
+    the current top predictions, whose floor the coordinator shares with the workers.
+
+    :param m: the graph
+    :param threshold: predictions with a probability below this number will be ignored
+    :param max_predictions: the maximum amount of predictions to generate (top N), None for all of them
+    :param max_hops: if specified, couplings along paths with more edges are not considered
+    :param workers: the amount of processes, by default the amount of CPUs
+    :param weights: the supernode weights, see `get_supernode_weights`
+    :param kernel: the similarity kernel, see `get_kernel`, it has to be picklable
+    :return: an array of (u, v, probability) triples sorted from the most to the least probable
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    with span("component split"):
+        compact = CompactGraph.from_networkx(m)
+        nodes = [compact.node_key(u) for u in range(compact.number_of_nodes())]
+        labels, codes, indptr, indices = compact.label_names, compact.codes, compact.indptr, compact.indices
+        if len(nodes) == 0:
+            return []
+        adjacency = sp.csr_matrix((np.ones(len(indices), dtype = np.int8), indices, indptr), shape = (len(nodes), len(nodes)))
+        component_count, membership = csgraph.connected_components(adjacency, directed = False)
+        order = np.argsort(membership, kind = "stable")
+        components = np.split(order, np.flatnonzero(np.diff(membership[order])) + 1)
+        # the workers only know the node positions
+        position = {u: k for k, u in enumerate(nodes)}
+        positional_weights = {position[u]: w for u, w in weights.items()} if weights else None
+        ranked = sorted(range(len(components)), key = lambda k: len(components[k]), reverse = True)
+    log(f"Analyzing {len(components)} component(s) with {workers} worker(s). The largest contains {max(len(c) for c in components)} nodes.")
+
+    shared = [__share(array) for array in [codes, indptr, indices]]
+    blocks = [block for block, spec in shared]
+    specs = [spec for block, spec in shared]
+    # negative as long as the top predictions are not complete
+    floor = multiprocessing.Value("d", -1.0)
+    heap = []
+    skipped = 0
+    try:
+        with multiprocessing.Pool(workers, initializer = __attach, initargs = (labels, specs, floor, threshold, max_hops, positional_weights, kernel)) as pool:
+            results = pool.imap(__infer_shared_component, [components[k] for k in ranked], chunksize = 16)
+            for position, (found, seconds, pruned) in enumerate(progress(results, total = len(ranked))):
+                if pruned:
+                    skipped += 1
+                    continue
+                instrumentation.record_component(len(components[ranked[position]]), seconds, len(found))
+                for u, v, p in found:
+                    push_prediction(heap, (nodes[u], nodes[v], p), max_predictions)
+                current = heap_floor(heap, max_predictions)
+                if current is not None:
+                    floor.value = current
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    count("skipped components", skipped)
+    if skipped > 0:
+        log(f"Skipped {skipped} component(s) which cannot improve the predictions.")
+    return sorted_predictions(heap)
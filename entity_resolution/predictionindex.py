@@ -0,0 +1,157 @@
+import hashlib
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from .data import normalize_entity_id
+
+magic = b"ERPI"
+"""The first bytes of a prediction index file."""
+
+version = 1
+
+header = struct.Struct("<4sIQQQQ")
+"""Magic, version, amount of devices, of predictions, of identities and the size of the identity ids."""
+
+
+def device_hash(id):
+    """
+    Returns the 64-bit hash under which a device is stored in a prediction index.
+
+    :param id: a device id, it is normalised first
+    :return: an unsigned integer
+    """
+    return int.from_bytes(hashlib.blake2b(str(normalize_entity_id(id)).encode("utf-8"), digest_size = 8).digest(), "little")
+
+
+def __padding(size):
+    return b"\0" * (-size % 8)
+
+
+def write_prediction_index(predictions, path):
+    """
+    Writes predictions as a binary index which `PredictionIndex` reads without a load step.
+    The file holds the sorted device hashes, the offsets of their predictions, the identity numbers with their probabilities
+    and the identity ids. It is written next to the path and moved in place, so readers either see the old or the new file.
+
+    :param predictions: an iterable of (device id, identity id, probability) triples, like the ids returned by `infer_identities`
+    :param path: the path of the index file
+    :return: the amount of devices in the index
+    """
+    identities = {}
+    by_device = {}
+    for device, identity, p in predictions:
+        identity = str(identity)
+        k = identities.setdefault(identity, len(identities))
+        by_device.setdefault(device_hash(device), []).append((k, p))
+    hashes = np.array(sorted(by_device), dtype = np.uint64)
+    offsets = np.zeros(len(hashes) + 1, dtype = np.uint64)
+    numbers = []
+    probabilities = []
+    for position, h in enumerate(hashes.tolist()):
+        found = sorted(by_device[h], key = lambda t: -t[1])
+        numbers.extend(k for k, p in found)
+        probabilities.extend(p for k, p in found)
+        offsets[position + 1] = len(numbers)
+    names = [id.encode("utf-8") for id in identities]
+    name_offsets = np.zeros(len(names) + 1, dtype = np.uint64)
+    name_offsets[1:] = np.cumsum([len(b) for b in names])
+    blob = b"".join(names)
+
+    numbers = np.array(numbers, dtype = np.uint32).tobytes()
+    probabilities = np.array(probabilities, dtype = np.float32).tobytes()
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(header.pack(magic, version, len(hashes), len(numbers) // 4, len(names), len(blob)))
+        f.write(hashes.tobytes())
+        f.write(offsets.tobytes())
+        f.write(numbers + __padding(len(numbers)))
+        f.write(probabilities + __padding(len(probabilities)))
+        f.write(name_offsets.tobytes())
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return len(hashes)
+
+
+class PredictionIndex(object):
+    """
+    Read-only view of a prediction index file, see `write_prediction_index`.
+    The file is memory-mapped and a lookup is a binary search over the device hashes, only the touched pages are read.
+    A new build can be moved over the path at any time, `refresh` then switches to it while the lookups in progress keep the old mapping.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the path of the index file
+        """
+        self.path = path
+        self._open()
+
+    def _open(self):
+        with open(self.path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            buffer = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        name, file_version, devices, predictions, identities, blob_size = header.unpack_from(buffer, 0)
+        if name != magic or file_version != version:
+            raise Exception(f"'{self.path}' is not a prediction index of version {version}.")
+        position = header.size
+        arrays = []
+        for dtype, amount in [(np.uint64, devices), (np.uint64, devices + 1), (np.uint32, predictions), (np.float32, predictions), (np.uint64, identities + 1)]:
+            array = np.frombuffer(buffer, dtype = dtype, count = amount, offset = position)
+            position += array.nbytes + (-array.nbytes % 8)
+            arrays.append(array)
+        self.stat = stat
+        # a single assignment, a lookup works on one build from start to end
+        self.view = (buffer, position, *arrays)
+
+    def __len__(self):
+        return len(self.view[2])
+
+    def lookup(self, device_id):
+        """
+        Returns the predicted identities of a device.
+
+        :param device_id: the device id
+        :return: an array of (identity id, probability) couples from the most to the least probable, empty for an unknown device
+        """
+        buffer, blob_start, hashes, offsets, identities, probabilities, name_offsets = self.view
+        h = np.uint64(device_hash(device_id))
+        position = int(np.searchsorted(hashes, h))
+        if position == len(hashes) or hashes[position] != h:
+            return []
+        coll = []
+        for k in range(int(offsets[position]), int(offsets[position + 1])):
+            number = int(identities[k])
+            start = blob_start + int(name_offsets[number])
+            end = blob_start + int(name_offsets[number + 1])
+            coll.append((buffer[start:end].decode("utf-8"), round(float(probabilities[k]), 2)))
+        return coll
+
+    def refresh(self):
+        """
+        Switches to the file currently at the path if it was replaced since it was opened.
+
+        :return: True if a new build was opened
+        """
+        stat = os.stat(self.path)
+        if (stat.st_ino, stat.st_mtime_ns, stat.st_size) == (self.stat.st_ino, self.stat.st_mtime_ns, self.stat.st_size):
+            return False
+        # the arrays of the previous build remain valid until they are released
+        self._open()
+        return True
+
+    def close(self):
+        """
+        Releases the arrays, the mapping is closed once no lookup uses it anymore.
+        """
+        self.view = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,61 @@
+import heapq
+import itertools
+
+__counter = itertools.count()
+"""Tie-breaker keeping the heap away from comparing the predictions themselves."""
+
+
+def push_prediction(heap, prediction, max_predictions = 100):
+    """
+    Adds a (u, v, probability) prediction to a bounded min-heap of the best predictions.
+
+    :param heap: the heap, a list
+    :param prediction: the (u, v, probability) triple
+    :param max_predictions: the size of the heap, None for no bound
+    :return: True if the prediction was kept
+    """
+    entry = (prediction[2], -next(__counter), prediction)
+    if max_predictions is None or len(heap) < max_predictions:
+        heapq.heappush(heap, entry)
+        return True
+    if prediction[2] > heap[0][0]:
+        heapq.heapreplace(heap, entry)
+        return True
+    return False
+
+
+def heap_floor(heap, max_predictions = 100):
+    """
+    Returns the probability a new prediction has to exceed to enter the heap.
+
+    :param heap: the heap
+    :param max_predictions: the size of the heap, None for no bound
+    :return: the lowest probability in a full heap, otherwise None
+    """
+    if max_predictions is None or len(heap) < max_predictions or len(heap) == 0:
+        return None
+    return heap[0][0]
+
+
+def sorted_predictions(heap):
+    """
+    Returns the predictions in the heap from the most to the least probable.
+
+    :param heap: the heap
+    :return: an array of (u, v, probability) triples
+    """
+    return [entry[2] for entry in sorted(heap, reverse = True)]
+
+
+def top_predictions(predictions, max_predictions = 100):
+    """
+    Returns the most probable predictions.
+
+    :param predictions: an iterable of (u, v, probability) triples
+    :param max_predictions: how many to return, None for all of them
+    :return: an array of (u, v, probability) triples sorted from the most to the least probable
+    """
+    heap = []
+    for prediction in predictions:
+        push_prediction(heap, prediction, max_predictions)
+    return sorted_predictions(heap)
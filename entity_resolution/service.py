@@ -0,0 +1,246 @@
+import argparse
+import asyncio
+import collections
+import json
+import time
+from urllib.parse import unquote, urlsplit
+
+from .data import iter_raw_entities, normalize_entity_id
+from .incremental import IncrementalResolver
+from .instrumentation import log
+
+
+class ResolutionService(object):
+    """
+    Serves identity resolutions from a graph held in memory.
+    The predictions come from an `IncrementalResolver`, which only recomputes the components touched by an ingested batch,
+    so the prediction table stays valid between requests and lookups are dictionary reads.
+    """
+
+    max_latencies = 10000
+    """The amount of recent latencies kept per endpoint for the percentiles."""
+
+    def __init__(self, resolver = None, threshold = 0.1, max_hops = None):
+        """
+        :param resolver: an `IncrementalResolver` to serve, by default an empty one
+        :param threshold: predictions with a probability below this number will be ignored, when the resolver is created
+        :param max_hops: if specified, couplings along paths with more edges are not considered, when the resolver is created
+        """
+        if resolver is None:
+            resolver = IncrementalResolver(threshold, max_hops)
+        self.resolver = resolver
+        self.identities = {}
+        for device, identity, p in resolver.get_predictions():
+            self.identities.setdefault(identity, {})[device] = p
+        self.started = time.perf_counter()
+        self.requests = {}
+        self.latencies = {}
+
+    @classmethod
+    def from_raw(cls, raw_directory, threshold = 0.1, max_hops = None):
+        """
+        Creates a service from the gzip files in the given directory.
+
+        :param raw_directory: the directory containing the gzip files
+        :param threshold: predictions with a probability below this number will be ignored
+        :param max_hops: if specified, couplings along paths with more edges are not considered
+        :return: a service
+        """
+        service = cls(None, threshold, max_hops)
+        service.ingest(iter_raw_entities(raw_directory))
+        return service
+
+    def ingest(self, entities):
+        """
+        Adds entities and refreshes the predictions of the components they touch.
+
+        :param entities: an iterable of entity dictionaries, see `transform_raw_line_to_entity`
+        :return: a dictionary with the 'added', 'changed' and 'removed' (device id, identity id, probability) triples
+        """
+        delta = self.resolver.add_entities(entities)
+        for device, identity, p in delta["added"] + delta["changed"]:
+            self.identities.setdefault(identity, {})[device] = p
+        for device, identity, p in delta["removed"]:
+            devices = self.identities.get(identity, {})
+            devices.pop(device, None)
+            if len(devices) == 0:
+                self.identities.pop(identity, None)
+        return delta
+
+    def _linked(self, u, label):
+        g = self.resolver.graph
+        neighbors = set(g.successors(u)) | set(g.predecessors(u))
+        return sorted(g.nodes[v]["id"] for v in neighbors if g.nodes[v]["label"] == label)
+
+    def resolve_device(self, id):
+        """
+        Returns the identities of a device.
+
+        :param id: the device id
+        :return: a dictionary with the 'known' identity ids and the 'inferred' [identity id, probability] couples, None for an unknown device
+        """
+        u = self.resolver.get_node("Device", id)
+        if u is None:
+            return None
+        inferred = [[self.resolver.graph.nodes[i]["id"], p] for i, p in self.resolver.predictions.get(u, {}).items()]
+        return {"device": normalize_entity_id(id), "known": self._linked(u, "Identity"), "inferred": sorted(inferred, key = lambda t: -t[1])}
+
+    def resolve_identity(self, id):
+        """
+        Returns the devices of an identity.
+
+        :param id: the identity id
+        :return: a dictionary with the 'known' device ids and the 'inferred' [device id, probability] couples, None for an unknown identity
+        """
+        u = self.resolver.get_node("Identity", id)
+        if u is None:
+            return None
+        identity = normalize_entity_id(id)
+        inferred = [[device, p] for device, p in self.identities.get(identity, {}).items()]
+        return {"identity": identity, "known": self._linked(u, "Device"), "inferred": sorted(inferred, key = lambda t: -t[1])}
+
+    def record(self, endpoint, seconds):
+        """
+        Records the latency of a request.
+
+        :param endpoint: the name of the endpoint
+        :param seconds: the time spent answering
+        """
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        if endpoint not in self.latencies:
+            self.latencies[endpoint] = collections.deque(maxlen = self.max_latencies)
+        self.latencies[endpoint].append(seconds)
+
+    def stats(self):
+        """
+        Returns the request counters.
+
+        :return: a dictionary with the 'uptime' in seconds and per endpoint the 'requests', the 'qps' since the start and the mean, p50 and p99 latencies in milliseconds of the recent requests
+        """
+        uptime = time.perf_counter() - self.started
+        endpoints = {}
+        for endpoint, count in self.requests.items():
+            latencies = sorted(self.latencies[endpoint])
+            endpoints[endpoint] = {
+                "requests": count,
+                "qps": round(count / uptime, 2),
+                "mean_ms": round(1000 * sum(latencies) / len(latencies), 3),
+                "p50_ms": round(1000 * latencies[len(latencies) // 2], 3),
+                "p99_ms": round(1000 * latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))], 3)
+            }
+        return {"uptime": round(uptime, 1), "devices": len(self.resolver.attributes), "nodes": self.resolver.graph.number_of_nodes(), "endpoints": endpoints}
+
+    def handle(self, method, path, body):
+        """
+        Answers a request.
+
+        :param method: the HTTP method
+        :param path: the request path
+        :param body: the request body
+        :return: (endpoint name, HTTP status, JSON-serialisable answer)
+        """
+        parts = [unquote(p) for p in urlsplit(path).path.strip("/").split("/")]
+        if method == "GET" and len(parts) == 3 and parts[0] == "resolve" and parts[1] in ["device", "identity"]:
+            endpoint = "resolve " + parts[1]
+            found = self.resolve_device(parts[2]) if parts[1] == "device" else self.resolve_identity(parts[2])
+            if found is None:
+                return endpoint, 404, {"error": f"Unknown {parts[1]} '{parts[2]}'."}
+            return endpoint, 200, found
+        if method == "POST" and parts == ["ingest"]:
+            try:
+                entities = json.loads(body)
+            except ValueError:
+                return "ingest", 400, {"error": "The body should be a JSON array of entities."}
+            if isinstance(entities, dict):
+                entities = [entities]
+            if not isinstance(entities, list):
+                return "ingest", 400, {"error": "The body should be a JSON array of entities."}
+            try:
+                # the whole batch is checked before the graph changes
+                for r in entities:
+                    self.resolver.check_entity(r)
+            except ValueError as e:
+                return "ingest", 400, {"error": str(e)}
+            delta = self.ingest(entities)
+            return "ingest", 200, {k: len(v) for k, v in delta.items()}
+        if method == "GET" and parts == ["stats"]:
+            return "stats", 200, self.stats()
+        return "unknown", 404, {"error": f"No route for {method} {path}."}
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                started = time.perf_counter()
+                method, path, version = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode("latin-1").split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length > 0 else b""
+                try:
+                    endpoint, status, answer = self.handle(method, path, body)
+                except Exception as e:
+                    # the connection stays usable, the client gets the reason
+                    endpoint, status, answer = "error", 500, {"error": str(e)}
+                content = json.dumps(answer).encode("utf-8")
+                close = headers.get("connection", "").lower() == "close" or version.strip() == "HTTP/1.0"
+                writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\nContent-Length: {len(content)}\r\n"
+                             f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode("latin-1") + content)
+                await writer.drain()
+                self.record(endpoint, time.perf_counter() - started)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host = "127.0.0.1", port = 8080):
+        """
+        Starts listening, the requests are answered on the running event loop.
+
+        :param host: the interface to bind
+        :param port: the port, zero for any free one
+        :return: the asyncio server
+        """
+        return await asyncio.start_server(self._serve_connection, host, port)
+
+
+async def __serve_forever(service, host, port):
+    server = await service.start(host, port)
+    log(f"Serving on {', '.join(str(s.getsockname()) for s in server.sockets)}.")
+    async with server:
+        await server.serve_forever()
+
+
+def serve(service, host = "127.0.0.1", port = 8080):
+    """
+    Runs the HTTP service until interrupted.
+    The routes are `GET /resolve/device/<id>`, `GET /resolve/identity/<id>`, `POST /ingest` with a JSON array of entities and `GET /stats`.
+
+    :param service: a `ResolutionService`
+    :param host: the interface to bind
+    :param port: the port
+    """
+    try:
+        asyncio.run(__serve_forever(service, host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serves identity resolutions over HTTP.")
+    parser.add_argument("--raw", help = "a directory with gzip files to load at startup")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8080)
+    parser.add_argument("--threshold", type = float, default = 0.1)
+    arguments = parser.parse_args()
+    service = ResolutionService(threshold = arguments.threshold) if arguments.raw is None else ResolutionService.from_raw(arguments.raw, arguments.threshold)
+    serve(service, arguments.host, arguments.port)
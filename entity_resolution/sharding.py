@@ -0,0 +1,290 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import pickle
+import shutil
+import socket
+import tempfile
+import time
+
+import networkx as nx
+
+from .inference import get_components, component_upper_bound, infer_component
+from .cache import node_key
+from .instrumentation import instrumented, span, count, log
+from .ranking import push_prediction, heap_floor, sorted_predictions
+
+__folders = ["pending", "claimed", "done"]
+
+
+def shard_of(g, component, shards):
+    """
+    Returns the shard of a component, a hash of its smallest (label, id) key so that it does not depend on the node numbering.
+
+    :param g: a graph
+    :param component: the nodes of the component
+    :param shards: the amount of shards
+    :return: a number between zero and `shards` excluded
+    """
+    key = min(node_key(g, u) for u in component)
+    digest = hashlib.sha256("\t".join(key).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little") % shards
+
+
+def __write(path, content):
+    """
+    Pickles the content next to the path and moves it in place, readers never see a partial file.
+    """
+    temporary = f"{path}.{socket.gethostname()}-{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        pickle.dump(content, f, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+
+def write_shards(m, shard_directory, shards = 8, threshold = 0.1, max_predictions = 100, max_hops = None, weights = None, kernel = None):
+    """
+    Hash-partitions the connected components of the graph into shard files a worker can process on its own.
+    Every shard holds the undirected subgraphs of its components together with the inference settings.
+    The files of a previous run in the directory are removed and the new names carry a run id,
+    so a late worker of an earlier run cannot pass its results off as the new ones.
+
+    :param m: the graph
+    :param shard_directory: a directory the workers can reach, for instance on a shared file system
+    :param shards: the amount of shards
+    :param threshold: predictions with a probability below this number will be ignored
+    :param max_predictions: the maximum amount of predictions per shard, None for all of them
+    :param max_hops: if specified, couplings along paths with more edges are not considered
+    :param weights: the supernode weights, see `get_supernode_weights`
+    :param kernel: the similarity kernel, see `get_kernel`, it has to be picklable
+    :return: the names of the written shard files
+    """
+    for folder in __folders:
+        os.makedirs(os.path.join(shard_directory, folder), exist_ok = True)
+        for name in os.listdir(os.path.join(shard_directory, folder)):
+            try:
+                os.remove(os.path.join(shard_directory, folder, name))
+            except FileNotFoundError:
+                continue
+    run = os.urandom(4).hex()
+    if os.path.exists(os.path.join(shard_directory, "closed")):
+        os.remove(os.path.join(shard_directory, "closed"))
+    g = m.to_undirected(as_view = True)
+    members = [[] for k in range(shards)]
+    with span("component split"):
+        for c in get_components(m):
+            if any(g.nodes[u]["label"] == "Identity" for u in c):
+                members[shard_of(g, c, shards)].append(c)
+    names = []
+    for k, components in enumerate(members):
+        if len(components) == 0:
+            continue
+        nodes = set().union(*components)
+        shard = {
+            "components": [nx.Graph(g.subgraph(c)) for c in components],
+            "threshold": threshold,
+            "max_predictions": max_predictions,
+            "max_hops": max_hops,
+            "weights": None if weights is None else {u: w for u, w in weights.items() if u in nodes},
+            "kernel": kernel
+        }
+        name = f"shard-{run}-{k:05d}.pkl"
+        __write(os.path.join(shard_directory, "pending", name), shard)
+        names.append(name)
+    count("shards", len(names))
+    return names
+
+
+def infer_shard(shard):
+    """
+    Infers the identities of the components of a shard.
+
+    :param shard: the content of a shard file, see `write_shards`
+    :return: an array of (u, v, probability) triples sorted from the most to the least probable
+    """
+    threshold, max_predictions = shard["threshold"], shard["max_predictions"]
+    heap = []
+    for h in shard["components"]:
+        bound = round(component_upper_bound(h, h.nodes(), shard["weights"], shard["kernel"]), 2)
+        floor = heap_floor(heap, max_predictions)
+        if bound < threshold or (floor is not None and bound <= floor):
+            continue
+        found = infer_component(h, threshold if floor is None else max(threshold, floor), None, shard["max_hops"], weights = shard["weights"], kernel = shard["kernel"])
+        for prediction in found:
+            push_prediction(heap, prediction, max_predictions)
+    return sorted_predictions(heap)
+
+
+def claim_shard(shard_directory, worker = None):
+    """
+    Claims a pending shard by moving it to the claimed folder, the rename succeeds for one worker only.
+
+    :param shard_directory: the shard directory
+    :param worker: the name of the worker, by default the host name and the process id
+    :return: the path of the claimed file or None if no shard is pending
+    """
+    if worker is None:
+        worker = f"{socket.gethostname()}-{os.getpid()}"
+    for name in sorted(os.listdir(os.path.join(shard_directory, "pending"))):
+        if not name.endswith(".pkl"):
+            continue
+        claimed = os.path.join(shard_directory, "claimed", f"{name}.{worker}")
+        try:
+            os.rename(os.path.join(shard_directory, "pending", name), claimed)
+        except FileNotFoundError:
+            # another worker was faster
+            continue
+        # the claim time is the modification time, see `release_stale_claims`
+        os.utime(claimed)
+        return claimed
+    return None
+
+
+def run_worker(shard_directory, poll_interval = None, worker = None):
+    """
+    Processes pending shards until there are none left and writes their predictions to the done folder.
+    The same function runs on every host sharing the shard directory.
+
+    :param shard_directory: the shard directory
+    :param poll_interval: if specified, the worker keeps waiting for new shards with this amount of seconds between two looks until the coordinator closes the directory
+    :param worker: the name of the worker, by default the host name and the process id
+    :return: the amount of shards processed
+    """
+    processed = 0
+    while True:
+        claimed = claim_shard(shard_directory, worker)
+        if claimed is None:
+            if poll_interval is None or os.path.exists(os.path.join(shard_directory, "closed")):
+                return processed
+            time.sleep(poll_interval)
+            continue
+        try:
+            with open(claimed, "rb") as f:
+                shard = pickle.load(f)
+        except FileNotFoundError:
+            # released again before it could be read
+            continue
+        name = os.path.basename(claimed).split(".pkl")[0] + ".pkl"
+        __write(os.path.join(shard_directory, "done", name), infer_shard(shard))
+        try:
+            os.remove(claimed)
+        except FileNotFoundError:
+            # the claim was handed out again meanwhile, the result of either worker is the same
+            pass
+        processed += 1
+
+
+def release_stale_claims(shard_directory, stale_after = 0, workers = None):
+    """
+    Moves the claimed shards back to the pending folder, for instance after a worker died.
+
+    :param shard_directory: the shard directory
+    :param stale_after: only the claims older than this amount of seconds are released
+    :param workers: if specified, only the claims of the workers with these names are released
+    :return: the amount of released shards
+    """
+    released = 0
+    now = time.time()
+    for name in os.listdir(os.path.join(shard_directory, "claimed")):
+        if workers is not None and name.split(".pkl.", 1)[-1] not in workers:
+            continue
+        path = os.path.join(shard_directory, "claimed", name)
+        try:
+            if now - os.path.getmtime(path) < stale_after:
+                continue
+            os.rename(path, os.path.join(shard_directory, "pending", name.split(".pkl")[0] + ".pkl"))
+            released += 1
+        except FileNotFoundError:
+            # finished in the meantime
+            continue
+    return released
+
+
+def merge_shards(shard_directory, names, max_predictions = 100):
+    """
+    Merges the partial predictions of the given shards.
+
+    :param shard_directory: the shard directory
+    :param names: the names of the shard files
+    :param max_predictions: the maximum amount of predictions to return, None for all of them
+    :return: an array of (u, v, probability) triples sorted from the most to the least probable
+    """
+    heap = []
+    for name in names:
+        with open(os.path.join(shard_directory, "done", name), "rb") as f:
+            for prediction in pickle.load(f):
+                push_prediction(heap, prediction, max_predictions)
+    return sorted_predictions(heap)
+
+
+def wait_for_shards(shard_directory, names, processes = (), poll_interval = 0.5, stale_after = None):
+    """
+    Waits until the given shards are done.
+    Once the local worker processes are gone, the coordinator releases the claims they left behind and processes
+    the pending shards itself. The claims of other workers are only released when older than `stale_after`.
+
+    :param shard_directory: the shard directory
+    :param names: the names of the shard files
+    :param processes: the local worker processes, see `run_worker`
+    :param poll_interval: the amount of seconds between two looks at the finished shards
+    :param stale_after: if specified, shards claimed for longer than this amount of seconds are handed out again
+    """
+    local = {f"{socket.gethostname()}-{process.pid}" for process in processes}
+    while not all(os.path.exists(os.path.join(shard_directory, "done", name)) for name in names):
+        if len(processes) > 0 and not any(process.is_alive() for process in processes):
+            release_stale_claims(shard_directory, workers = local)
+            run_worker(shard_directory, worker = "coordinator")
+        if stale_after is not None:
+            release_stale_claims(shard_directory, stale_after)
+        time.sleep(poll_interval)
+
+
+@instrumented("sharded inference")
+def infer_sharded_identities(m, threshold = 0.1, max_predictions = 100, max_hops = None, shards = 8, workers = 2, shard_directory = None, weights = None, kernel = None, poll_interval = 0.5, stale_after = None):
+    """
+    Infers identities by spreading the components over shards processed by worker processes.
+    The coordinator writes the shards to a directory, starts the local workers and merges the partial predictions.
+    Workers on other hosts join with `python -m entity_resolution.sharding <shard directory> --poll 1`
+    when the directory is on a shared file system.
+
+    :param m: the graph
+    :param threshold: predictions with a probability below this number will be ignored
+    :param max_predictions: the maximum amount of predictions to generate (top N), None for all of them
+    :param max_hops: if specified, couplings along paths with more edges are not considered
+    :param shards: the amount of shards
+    :param workers: the amount of local worker processes, zero to rely on remote workers only
+    :param shard_directory: the directory of the shards, by default a temporary one which is removed afterwards
+    :param weights: the supernode weights, see `get_supernode_weights`
+    :param kernel: the similarity kernel, see `get_kernel`, it has to be picklable
+    :param poll_interval: the amount of seconds between two looks at the finished shards
+    :param stale_after: if specified, shards claimed for longer than this amount of seconds are handed out again
+    :return: an array of (u, v, probability) triples sorted from the most to the least probable
+    """
+    temporary = shard_directory is None
+    if temporary:
+        shard_directory = tempfile.mkdtemp()
+    try:
+        names = write_shards(m, shard_directory, shards, threshold, max_predictions, max_hops, weights, kernel)
+        log(f"Written {len(names)} shard(s) to '{shard_directory}'.")
+        processes = [multiprocessing.Process(target = run_worker, args = (shard_directory,)) for k in range(workers)]
+        for process in processes:
+            process.start()
+        with span("shard inference"):
+            wait_for_shards(shard_directory, names, processes, poll_interval, stale_after)
+        for process in processes:
+            process.join()
+        with open(os.path.join(shard_directory, "closed"), "w") as f:
+            f.write("closed")
+        with span("merge"):
+            return merge_shards(shard_directory, names, max_predictions)
+    finally:
+        if temporary:
+            shutil.rmtree(shard_directory, ignore_errors = True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Processes the pending shards of a sharded inference.")
+    parser.add_argument("shard_directory", help = "the shard directory written by the coordinator")
+    parser.add_argument("--poll", type = float, default = None, help = "keep waiting for shards with this amount of seconds between two looks until the coordinator is done")
+    arguments = parser.parse_args()
+    print(f"Processed {run_worker(arguments.shard_directory, arguments.poll)} shard(s).")
@@ -0,0 +1,110 @@
+import functools
+
+import numpy as np
+
+from .sparse import graph_to_incidence, sparse_candidates, pair_jaccard
+
+
+def attribute_degrees(a):
+    """
+    Returns the amount of devices of every attribute.
+
+    :param a: the device × attribute incidence matrix
+    :return: an array with the column sums
+    """
+    return np.asarray(a.sum(axis = 0)).ravel()
+
+
+def __scaled(w, scale):
+    return scale if w is None else w * scale
+
+
+def jaccard_kernel(a, rows, cols, w = None, labels = None):
+    """
+    Scores device couples with the (weighted) Jaccard similarity of their attribute sets.
+    Every kernel takes the same arguments and returns one score between zero and one per couple.
+
+    :param a: the device × attribute incidence matrix
+    :param rows: the row indices of the first devices
+    :param cols: the row indices of the second devices
+    :param w: the attribute weights, see `get_supernode_weights`, None for all ones
+    :param labels: the label of every attribute
+    :return: the similarities
+    """
+    return pair_jaccard(a, rows, cols, w)
+
+
+def adamic_adar_kernel(a, rows, cols, w = None, labels = None):
+    """
+    Scores device couples like the Adamic-Adar index, where a shared attribute counts for 1 / log(degree),
+    normalised by the weight of the union of the attribute sets.
+    """
+    scale = 1 / np.log(np.maximum(attribute_degrees(a), 2))
+    return pair_jaccard(a, rows, cols, __scaled(w, scale))
+
+
+def resource_allocation_kernel(a, rows, cols, w = None, labels = None):
+    """
+    Scores device couples like the resource allocation index, where a shared attribute counts for 1 / degree,
+    normalised by the weight of the union of the attribute sets.
+    """
+    scale = 1 / np.maximum(attribute_degrees(a), 1)
+    return pair_jaccard(a, rows, cols, __scaled(w, scale))
+
+
+def label_weighted_kernel(a, rows, cols, w = None, labels = None, label_weights = None):
+    """
+    Scores device couples with a Jaccard similarity where every attribute counts for the weight of its label,
+    for instance a shared IP more than a shared Location. Missing labels count for one.
+    Use `get_kernel` with a dictionary label -> weight to obtain this kernel.
+    """
+    if label_weights is None:
+        label_weights = {}
+    scale = np.array([label_weights.get(label, 1.0) for label in labels], dtype = np.float64)
+    return pair_jaccard(a, rows, cols, __scaled(w, scale))
+
+
+kernels = {
+    "jaccard": jaccard_kernel,
+    "adamic_adar": adamic_adar_kernel,
+    "resource_allocation": resource_allocation_kernel,
+}
+"""The built-in similarity kernels by name."""
+
+
+def get_kernel(similarity = None):
+    """
+    Returns the similarity kernel corresponding to the given setting.
+
+    :param similarity: None or a kernel name (see `kernels`), a dictionary label -> weight for `label_weighted_kernel` or a kernel function
+    :return: a function (a, rows, cols, w, labels) -> similarities
+    """
+    if similarity is None:
+        return jaccard_kernel
+    if isinstance(similarity, str):
+        if similarity not in kernels:
+            raise Exception(f"Unknown similarity '{similarity}'. Only {', '.join(kernels)} or a dictionary of label weights is supported.")
+        return kernels[similarity]
+    if isinstance(similarity, dict):
+        return functools.partial(label_weighted_kernel, label_weights = similarity)
+    return similarity
+
+
+def component_similarities(h, kernel = None, weights = None):
+    """
+    Scores all the device couples sharing an attribute in one batch.
+    Attributes with a supernode weight do not generate couples by themselves but still count in the scores.
+
+    :param h: an undirected graph
+    :param kernel: a similarity kernel, see `get_kernel`
+    :param weights: the supernode weights, see `get_supernode_weights`
+    :return: a dictionary (u, v) -> similarity
+    """
+    a, devices, attributes = graph_to_incidence(h)
+    if kernel is None:
+        kernel = jaccard_kernel
+    w = np.array([weights.get(u, 1.0) for u in attributes], dtype = np.float64) if weights else None
+    excluded = None if not weights else np.array([u in weights for u in attributes], dtype = bool)
+    rows, cols = sparse_candidates(a, excluded)
+    p = kernel(a, rows, cols, w, [h.nodes[u]["label"] for u in attributes])
+    return {(devices[u], devices[v]): float(s) for u, v, s in zip(rows, cols, p)}
@@ -5,6 +5,9 @@ import neo4j
 from .data import create_synthetic_graph
 from .inference import *
 from .data import *
+from .checkpoint import Checkpoint
+from .predictionindex import write_prediction_index
+from .instrumentation import instrumented, span, log
 import os
 import networkx as nx
 import pandas as pd
@@ -32,19 +35,19 @@ def demo(device_count = 150, identity_count = 50, cookie_probability = 0.3, ip_p
     inf, ids = infer_identities(g, threshold, True)
     g.add_edges_from([(u, v, {"p": p}) for u, v, p in inf], label = "INFERRED")
     graphml_path = os.path.join(os.getcwd(), "synthetic.graphml")
-    print("GraphML diagram at ", graphml_path)
+    log("GraphML diagram at ", graphml_path)
     nx.write_graphml(g, graphml_path)
     os.system(f"open {graphml_path}")
 
     df = inference_to_frame(ids)
     csv_path = os.path.join(os.getcwd(), "predictions.csv")
     df.to_csv(csv_path)
-    print("Predictions saved to ", csv_path)
+    log("Predictions saved to ", csv_path)
     node_count = len(g.nodes())
     edge_count = len(g.edges())
     identity_count = len([u for u in g.nodes() if g.nodes()[u]["label"] == "Identity"])
     inferred_count = len([e for e in g.edges() if g.edges()[e]["label"] == "INFERRED"])
-    print("Nodes:", node_count, "Edges:", edge_count, "Identities:", identity_count, "Inferred:", inferred_count)
+    log("Nodes:", node_count, "Edges:", edge_count, "Identities:", identity_count, "Inferred:", inferred_count)
     return g, df
 
 
@@ -61,7 +64,8 @@ def inference_to_frame(inf):
     return df
 
 
-def raw_to_predictions(raw_directory, threshold = 0.1, save_diagram = False, predictions_path = None, max_predictions = 100):
+@instrumented("raw to predictions")
+def raw_to_predictions(raw_directory, threshold = 0.1, save_diagram = False, predictions_path = None, max_predictions = 100, work_directory = None, resume_from = None, index_path = None):
     """
     Returns the inferred identities directly from the given directory of gzip TSV files.
 
@@ -70,22 +74,33 @@ def raw_to_predictions(raw_directory, threshold = 0.1, save_diagram = False, pre
     :param save_diagram: whether to save the generated diagram to GraphML for visualization purposes
     :param predictions_path: the path where the predictions as a CSV file will be save. If not specified it will be saved in the current directory as 'predictions.csv'.
     :param max_predictions: the maximum amount of predictions to generate (top N).
+    :param work_directory: if specified, the parsed graph and the inference progress are saved there
+    :param resume_from: the work directory of an interrupted run, its graph is loaded instead of parsing the files again and the inference continues where it stopped
+    :param index_path: if specified, the predictions are also written there as a binary index, see `PredictionIndex`
     :return: (graph, predictions frame)
     """
-
-    g = raw_to_graph(raw_directory)
-    inf, ids = infer_identities(g, threshold, True)
-    g.add_edges_from([(u, v, {"p": p}) for u, v, p in inf], label = "INFERRED")
-    if save_diagram:
-        graphml_path = os.path.join(os.getcwd(), "synthetic.graphml")
-        print("GraphML diagram at ", graphml_path)
-        nx.write_graphml(g, graphml_path)
-
-    df = inference_to_frame(ids).head(max_predictions)
-    if predictions_path is None:
-        predictions_path = os.path.join(os.getcwd(), "predictions.csv")
-    df.to_csv(predictions_path)
-    print("Predictions saved to ", predictions_path)
+    g = None
+    if resume_from is not None:
+        g = Checkpoint(resume_from).load_graph()
+    if g is None:
+        g = raw_to_graph(raw_directory)
+        if work_directory is not None or resume_from is not None:
+            Checkpoint(resume_from or work_directory).save_graph(g)
+    inf, ids = infer_identities(g, threshold, True, max_predictions, work_directory = work_directory, resume_from = resume_from)
+    with span("output"):
+        g.add_edges_from([(u, v, {"p": p}) for u, v, p in inf], label = "INFERRED")
+        if save_diagram:
+            graphml_path = os.path.join(os.getcwd(), "synthetic.graphml")
+            log("GraphML diagram at ", graphml_path)
+            nx.write_graphml(g, graphml_path)
+
+        df = inference_to_frame(ids).head(max_predictions)
+        if predictions_path is None:
+            predictions_path = os.path.join(os.getcwd(), "predictions.csv")
+        df.to_csv(predictions_path)
+        if index_path is not None:
+            write_prediction_index(ids, index_path)
+    log("Predictions saved to ", predictions_path)
     return g, df
 
 
@@ -96,7 +111,7 @@ def save_open_graph(g):
     :param g: a graph
     """
     graphml_path = os.path.join(os.getcwd(), "graph.graphml")
-    print("GraphML diagram at ", graphml_path)
+    log("GraphML diagram at ", graphml_path)
     nx.write_graphml(g, graphml_path)
     os.system(f"open {graphml_path}")
 
@@ -122,7 +137,7 @@ def neo_to_predictions(db_name = "neo4j", threshold = 0.1, max_predictions = 100
     if predictions_path is None:
         predictions_path = os.path.join(os.getcwd(), "predictions.csv")
     df.to_csv(predictions_path)
-    print("Predictions saved to ", predictions_path)
+    log("Predictions saved to ", predictions_path)
     return g, df
 
 
@@ -199,7 +214,7 @@ def entities_json_to_predictions(json_directory, file_extension = "txt", thresho
     if predictions_path is None:
         predictions_path = os.path.join(os.getcwd(), "predictions.csv")
     df.to_csv(predictions_path)
-    print("Predictions saved to ", predictions_path)
+    log("Predictions saved to ", predictions_path)
     return g, df
 
 
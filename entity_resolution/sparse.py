@@ -0,0 +1,177 @@
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+
+from .ranking import top_predictions
+from .instrumentation import span, count
+
+def graph_to_incidence(g):
+    """
+    Returns the device × attribute incidence of the given graph as a CSR matrix.
+    Every non-device neighbour of a device (Cookie, IP, Location and also Identity) counts as an attribute,
+    which mirrors the neighbourhoods used by `nx.algorithms.jaccard_coefficient`.
+
+    :param g: a graph
+    :return: (incidence matrix, list of device nodes, list of attribute nodes)
+    """
+    devices = [u for u in g.nodes() if g.nodes[u]["label"] == "Device"]
+    attributes = [u for u in g.nodes() if g.nodes[u]["label"] != "Device"]
+    device_index = {u: k for k, u in enumerate(devices)}
+    attribute_index = {u: k for k, u in enumerate(attributes)}
+    rows = []
+    cols = []
+    for u, v in g.edges():
+        if u in device_index and v in attribute_index:
+            rows.append(device_index[u])
+            cols.append(attribute_index[v])
+        elif v in device_index and u in attribute_index:
+            rows.append(device_index[v])
+            cols.append(attribute_index[u])
+    a = sp.csr_matrix((np.ones(len(rows), dtype = np.int32), (rows, cols)), shape = (len(devices), len(attributes)))
+    # an edge in both directions should only count once
+    a.sum_duplicates()
+    a.data[:] = 1
+    return a, devices, attributes
+
+
+def attribute_weights(attributes, weights = None):
+    """
+    Returns the similarity weight of every attribute column, one unless specified otherwise.
+
+    :param attributes: the attribute nodes (columns of the incidence)
+    :param weights: a dictionary node -> weight, see `get_supernode_weights`
+    :return: an array of weights or None if all of them are one
+    """
+    if not weights:
+        return None
+    return np.array([weights.get(u, 1.0) for u in attributes], dtype = np.float64)
+
+
+def sparse_jaccard(a, w = None):
+    """
+    Computes the Jaccard similarity of all device couples sharing at least one attribute.
+    The intersections are the off-diagonal entries of A·Aᵀ and the unions follow from the row degrees.
+    With column weights the similarity is the weighted Jaccard and the columns weighing less than one
+    (the supernodes) do not generate couples by themselves.
+
+    :param a: the device × attribute incidence matrix
+    :param w: the column weights, see `attribute_weights`
+    :return: (row indices, column indices, similarities) with row < column
+    """
+    if w is None:
+        intersections = sp.triu(a @ a.T, k = 1).tocoo()
+        degrees = np.asarray(a.sum(axis = 1)).ravel()
+        unions = degrees[intersections.row] + degrees[intersections.col] - intersections.data
+        return intersections.row, intersections.col, intersections.data / unions
+    rows, cols = sparse_candidates(a, w < 1)
+    return rows, cols, pair_jaccard(a, rows, cols, w)
+
+
+def sparse_candidates(a, excluded = None):
+    """
+    Returns the device couples sharing at least one attribute.
+
+    :param a: the device × attribute incidence matrix
+    :param excluded: a boolean mask of the attributes which should not generate couples
+    :return: (row indices, column indices) with row < column
+    """
+    if excluded is not None:
+        a = a[:, np.flatnonzero(~excluded)]
+    candidates = sp.triu(a @ a.T, k = 1).tocoo()
+    return candidates.row, candidates.col
+
+
+def pair_jaccard(a, rows, cols, w = None):
+    """
+    Computes the exact Jaccard similarity of the given device couples only.
+
+    :param a: the device × attribute incidence matrix
+    :param rows: the row indices of the first devices
+    :param cols: the row indices of the second devices
+    :param w: the column weights, see `attribute_weights`
+    :return: the similarities
+    """
+    if len(rows) == 0:
+        return np.zeros(0)
+    if w is None:
+        w = np.ones(a.shape[1])
+    intersections = np.asarray(a[rows].multiply(a[cols]) @ w).ravel()
+    degrees = np.asarray(a @ w).ravel()
+    unions = degrees[rows] + degrees[cols] - intersections
+    # devices only linked to excluded supernodes have no weight at all
+    return np.divide(intersections, unions, out = np.zeros(len(rows)), where = unions > 0)
+
+
+def couple_identities(m, a, devices, attributes, rows, cols, p, threshold = 0.1, max_predictions = 100):
+    """
+    Couples devices to identities through the given device similarities.
+    The coupling is the highest product of the similarities along a path from the identity, found with the
+    best-first search of `most_probable_couplings` on the CSR adjacency of the reduced graph. The search multiplies
+    the same probabilities in the same order as the networkx engine, so the rounded couplings are identical,
+    and it only visits the devices above the threshold.
+
+    :param m: the graph
+    :param a: the device × attribute incidence matrix
+    :param devices: the device nodes (rows of the incidence)
+    :param attributes: the attribute nodes (columns of the incidence)
+    :param rows: the row indices of the first devices
+    :param cols: the row indices of the second devices
+    :param p: the similarity of the device couples
+    :param threshold: predictions with a probability below this number will be ignored
+    :param max_predictions: the maximum amount of predictions to generate (top N), None for all of them
+    :return: an array of (u, v, probability) triples sorted from the most to the least probable
+    """
+    from .inference import most_probable_couplings
+
+    device_count = len(devices)
+    identity_columns = [k for k, u in enumerate(attributes) if m.nodes[u]["label"] == "Identity"]
+    identities = [attributes[k] for k in identity_columns]
+
+    # the reduced graph contains the devices followed by the identities, with the probabilities as values
+    keep = p > 0
+    links = a[:, identity_columns].tocoo()
+    size = device_count + len(identities)
+    w = sp.coo_matrix((np.concatenate([p[keep], np.ones(links.nnz)]), (np.concatenate([rows[keep], links.row]), np.concatenate([cols[keep], links.col + device_count]))),
+                      shape = (size, size)).tocsr()
+    w = (w + w.T).tocsr()
+    indptr, indices, data = w.indptr, w.indices, w.data
+    direct = a[:, identity_columns].T.tocsr()
+
+    def neighbors(u):
+        return zip(indices[indptr[u]:indptr[u + 1]].tolist(), data[indptr[u]:indptr[u + 1]].tolist())
+
+    coll = []
+    for k in range(len(identities)):
+        linked = set(direct.indices[direct.indptr[k]:direct.indptr[k + 1]].tolist())
+        found = most_probable_couplings(neighbors, device_count + k, threshold)
+        for node, (c, hops, predecessor) in found.items():
+            if node >= device_count or node in linked:
+                continue
+            coll.append((devices[node], identities[k], round(c, 2)))
+    return top_predictions(coll, max_predictions)
+
+
+def infer_sparse_identities(m: nx.DiGraph, threshold = 0.1, max_predictions = 100, weights = None, kernel = None):
+    """
+    Infers identities with sparse matrix products instead of per-pair networkx calls.
+    This is the 'sparse' engine of `infer_identities` and returns the same (device, identity, p) triples.
+
+    :param m: the graph
+    :param threshold: predictions with a probability below this number will be ignored
+    :param max_predictions: the maximum amount of predictions to generate (top N), None for all of them
+    :param weights: the supernode weights, see `get_supernode_weights`
+    :param kernel: the similarity kernel, see `get_kernel`, None for the Jaccard similarity
+    :return: an array of (u, v, probability) triples sorted from the most to the least probable
+    """
+    with span("graph build"):
+        a, devices, attributes = graph_to_incidence(m)
+        w = attribute_weights(attributes, weights)
+    with span("similarity"):
+        if kernel is None:
+            rows, cols, p = sparse_jaccard(a, w)
+        else:
+            rows, cols = sparse_candidates(a, None if w is None else w < 1)
+            p = kernel(a, rows, cols, w, [m.nodes[u]["label"] for u in attributes])
+    count("candidate pairs", len(rows))
+    with span("path search"):
+        return couple_identities(m, a, devices, attributes, rows, cols, p, threshold, max_predictions)
@@ -0,0 +1,81 @@
+class UnionFind(object):
+    """
+    Disjoint sets with union by size and path halving, used to track connected components
+    while a graph is being built.
+    """
+
+    def __init__(self, elements = None):
+        """
+        :param elements: optional initial elements, each in its own set
+        """
+        self.parent = {}
+        self.size = {}
+        if elements is not None:
+            for x in elements:
+                self.add(x)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def __contains__(self, x):
+        return x in self.parent
+
+    def add(self, x):
+        """
+        Adds the given element in its own set, if not present yet.
+
+        :param x: a hashable element
+        """
+        if x not in self.parent:
+            self.parent[x] = x
+            self.size[x] = 1
+
+    def find(self, x):
+        """
+        Returns the representative of the set containing the given element.
+
+        :param x: an element
+        :return: the representative element
+        """
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, x, y):
+        """
+        Merges the sets containing the given elements, adding them if needed.
+
+        :param x: an element
+        :param y: another element
+        :return: the representative of the merged set
+        """
+        self.add(x)
+        self.add(y)
+        x = self.find(x)
+        y = self.find(y)
+        if x == y:
+            return x
+        if self.size[x] < self.size[y]:
+            x, y = y, x
+        self.parent[y] = x
+        self.size[x] += self.size.pop(y)
+        return x
+
+    def connected(self, x, y):
+        """
+        Returns whether the given elements belong to the same set.
+        """
+        return self.find(x) == self.find(y)
+
+    def groups(self):
+        """
+        Returns the sets.
+
+        :return: a dictionary representative -> list of elements
+        """
+        coll = {}
+        for x in self.parent:
+            coll.setdefault(self.find(x), []).append(x)
+        return coll
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import math
+import random
 
 from entity_resolution import *
 from pathlib import Path
@@ -22,6 +23,26 @@ class DataTests(unittest.TestCase):
         entity = transform_raw_line_to_entity(line)
         print(entity)
 
+    def test_raw_line_extractor(self):
+        extractor = RawLineExtractor()
+        lines = [create_raw_line("D1", "1.2.3.4", "Paris", "I1", "C1"), create_raw_line("", "1.2.3.4", "Paris", "I1", "C1").encode("utf-8")]
+        entity = extractor.extract(lines[0])
+        assert entity == {"Device": "D1", "IP": "1.2.3.4", "Location": "Paris", "Identity": "I1", "Cookie": "C1"}
+        assert transform_raw_line_to_entity(lines[0]) == entity
+        assert extractor.extract_many(lines) == [entity]
+        # a context in another layout goes through the JSON parser
+        ctx = '{"data":[{"data":{"city":{"names":{"en":"A"},"geoname_id":42}},"schema":"iglu:com.dbip/location/jsonschema/1-0-0"}]}'
+        assert extractor.location(ctx) == "42"
+        assert extractor.location('{"data":[]}') is None
+        # the cache is keyed on the location context, not on the headers around it
+        extractor = RawLineExtractor()
+        for k in range(10):
+            ctx = '{"data":[{"schema":"iglu:org.ietf/http_header/jsonschema/1-0-0","data":{"name":"X-Forwarded-For","value":"10.0.0.%d"}},' % k
+            ctx += '{"schema":"iglu:com.dbip/location/jsonschema/1-0-0","data":{"continent":{"code":"EU"},"city":{"geoname_id":%d,"names":{"en":"A"}}}}]}' % (k % 2)
+            assert extractor.location(ctx) == get_city_from_string(ctx)[0] == str(k % 2)
+        assert extractor.parse_location.cache_info().misses == 2
+        assert extractor.parse_location.cache_info().hits == 8
+
     def test_raw_and_back(self):
         raw_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "raw")
         # ensure the directory is there
@@ -37,9 +58,72 @@ class DataTests(unittest.TestCase):
         assert len(g.nodes()) == len(h.nodes())
         assert len(g.edges()) == len(h.edges())
 
+        # the stream is lazy and yields the entities of raw_to_entities_json
+        stream = iter_raw_entities(raw_dir)
+        assert not isinstance(stream, list)
+        assert list(stream) == raw_to_entities_json(raw_dir)
+
         # clean up
         shutil.rmtree(raw_dir)
 
+    def test_union_find_components(self):
+        g = create_synthetic_graph(300, 100)
+        h = entities_json_to_graph(graph_to_entities_json(g))
+        expected = sorted(sorted(c) for c in nx.connected_components(h.to_undirected()))
+        assert sorted(sorted(c) for c in h.union_find.groups().values()) == expected
+
+        # an edge added afterwards merges two components the union-find does not know about
+        blank = {"IP": "", "Location": "", "Identity": "", "Cookie": ""}
+        m = entities_json_to_graph([dict(blank, Device = "d1", Identity = "i1", Cookie = "c1"), dict(blank, Device = "d2", Cookie = "c2")])
+        assert infer_identities(m)[0] == []
+        index = get_node_index(m)
+        m.add_edge(index[("Device", "d2")], index[("Cookie", "c1")])
+        assert get_union_find(m) is None
+        assert infer_identities(m)[0] == infer_identities(m.copy())[0] != []
+        assert infer_identity_edges(m) == infer_identity_edges(m.copy()) != []
+
+        # replacing an edge keeps the amounts of nodes and edges
+        m = entities_json_to_graph([dict(blank, Device = "d1", Identity = "i1", Cookie = "c1"), dict(blank, Device = "d2", Cookie = "c2"), dict(blank, Device = "d3", Cookie = "c3")])
+        index = get_node_index(m)
+        m.remove_edge(index[("Device", "d3")], index[("Cookie", "c3")])
+        m.add_edge(index[("Device", "d2")], index[("Cookie", "c1")])
+        assert get_union_find(m) is None
+        assert infer_identities(m)[0] == infer_identities(m.copy())[0] != []
+
+    def test_compact_graph(self):
+        g = create_synthetic_graph(300, 100)
+        c = CompactGraph.from_networkx(g)
+        assert c.number_of_nodes() == len(g.nodes())
+        assert c.number_of_edges() == len(g.edges())
+        devices = [u for u in g.nodes() if g.nodes()[u]["label"] == "Device"]
+        assert [c.node_key(u) for u in c.nodes_with_label("Device")] == devices
+        u = devices[0]
+        assert c.id(u) == g.nodes()[u]["id"]
+        assert sorted(c.node_key(v) for v in c.neighbors(u)) == sorted(nx.all_neighbors(g, u))
+        h = c.to_networkx()
+        assert dict(h.nodes(data = True)) == dict(g.nodes(data = True))
+        assert sorted(h.edges(data = True)) == sorted(g.edges(data = True))
+
+    def test_seeded_synthetic_graph(self):
+        g = create_synthetic_graph(200, 40, seed = 7)
+        h = create_synthetic_graph(200, 40, seed = 7)
+        assert list(g.nodes(data = True)) == list(h.nodes(data = True))
+        assert list(g.edges()) == list(h.edges())
+        devices = [u for u in g.nodes() if g.nodes[u]["label"] == "Device"]
+        assert sorted(g.truth) == sorted(devices)
+        assert all(g.nodes[i]["label"] == "Identity" for i in g.truth.values())
+        # one observed device per identity
+        assert len(get_truth_pairs(g)) == 200 - 40
+        # the seed does not touch the global generators
+        random.seed(3)
+        create_synthetic_graph(50, 10, seed = 7)
+        drawn = random.random()
+        random.seed(3)
+        assert random.random() == drawn
+        g = create_synthetic_graph(200, 40, seed = 7, identity_affinity = 0.8)
+        h = create_synthetic_graph(200, 40, seed = 7, identity_affinity = 0.8)
+        assert list(g.edges()) == list(h.edges())
+
     # def test_create_neo_db(self):
     #     neo = Neo()
     #     dbs = neo.get_databases()
@@ -1,8 +1,30 @@
 # -*- coding: utf-8 -*-
 
 
+import asyncio
+import json
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+import tracemalloc
+import tempfile
 import unittest
-from entity_resolution import get_sample_graph, infer_identity_edges, infer_jaccard_identity
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+from entity_resolution import PredictionIndex, write_prediction_index
+from entity_resolution import ResolutionService, resolve_device, resolve_identity
+from entity_resolution.sharding import infer_shard
+from entity_resolution.benchmark import run_benchmarks, compare_benchmarks, measure, pipeline_steps
+from entity_resolution import write_shards, run_worker, merge_shards, release_stale_claims, wait_for_shards, infer_sharded_identities
+from entity_resolution import infer_out_of_core, graph_to_raw, raw_to_graph
+from entity_resolution import evaluate_predictions, evaluate_variants, pareto_front
+from entity_resolution import add_hook, remove_hook, get_report, set_quiet
+from entity_resolution import build_candidate_table, Checkpoint, ComponentCache, get_kernel, jaccard_kernel, resource_allocation_kernel
+from entity_resolution import graph_to_entities_json, entities_json_to_graph, IncrementalResolver
+from entity_resolution import get_sample_graph, create_synthetic_graph, infer_identity_edges, infer_jaccard_identity, infer_identities, get_candidate_pairs, most_probable_couplings, get_weighted_neighbors
 
 
 class InferenceTests(unittest.TestCase):
@@ -21,6 +43,413 @@ class InferenceTests(unittest.TestCase):
         assert len(inferred) == 2
         print(inferred)
 
+    def test_candidate_pairs(self):
+        g = get_sample_graph().to_undirected()
+        devices = [u for u in g.nodes() if g.nodes()[u]["label"] == "Device"]
+        assert get_candidate_pairs(g, devices) == [(1, 4), (4, 6)]
+
+    def test_sparse_engine(self):
+        g = get_sample_graph()
+        expected, _ = infer_identities(g)
+        inferred, _ = infer_identities(g, engine = "sparse")
+        assert sorted(inferred) == sorted(expected)
+
+        g = create_synthetic_graph(300, 100)
+        expected, _ = infer_identities(g, 0, max_predictions = 10000)
+        inferred, _ = infer_identities(g, 0, max_predictions = 10000, engine = "sparse")
+        assert sorted(inferred) == sorted(expected)
+
+    def test_engine_parity(self):
+        set_quiet()
+        # a Jaccard similarity of 3/8 sits exactly on a rounding edge
+        g = nx.DiGraph()
+        g.add_node(0, label = "Identity", id = "i")
+        for u in [1, 2]:
+            g.add_node(u, label = "Device", id = f"d{u}")
+        for k, label in enumerate(["Cookie", "Cookie", "Cookie", "IP", "IP", "IP", "Location"]):
+            g.add_node(10 + k, label = label, id = f"a{k}")
+        g.add_edges_from([(1, 0), (1, 10), (1, 11), (1, 12), (1, 13), (2, 10), (2, 11), (2, 12), (2, 14), (2, 15), (2, 16)])
+        graphs = [g] + [create_synthetic_graph(300, 60, seed = seed) for seed in range(4)]
+        for g in graphs:
+            for similarity in [None, "resource_allocation", {"Cookie": 1.5, "IP": 0.5, "Location": 0.25}]:
+                expected = sorted(infer_identities(g, max_predictions = None, similarity = similarity)[0])
+                for settings in [{"engine": "sparse"}, {"engine": "minhash", "num_perm": 128, "bands": 128}, {"workers": 2}]:
+                    assert sorted(infer_identities(g, max_predictions = None, similarity = similarity, **settings)[0]) == expected
+        assert infer_identities(graphs[0], max_predictions = None, engine = "sparse")[0] == [(2, 0, 0.38)]
+        set_quiet(False)
+
+    def test_top_predictions(self):
+        g = create_synthetic_graph(600, 200, 0.5, 0.5, 0.5)
+        everything, _ = infer_identities(g, max_predictions = None)
+        reports = []
+        add_hook(reports.append)
+        try:
+            top, _ = infer_identities(g, max_predictions = 10)
+        finally:
+            remove_hook(reports.append)
+        counters = reports[0]["counters"]
+        assert counters["skipped components"] > counters["components"]
+
+        # the small component with the best bound comes before the large one, which is then skipped
+        g = nx.DiGraph()
+        g.add_node(0, label = "Identity", id = "i1")
+        g.add_node(1, label = "Identity", id = "i2")
+        for u in range(2, 6):
+            g.add_node(u, label = "Device", id = f"d{u}")
+        for k in range(22):
+            g.add_node(10 + k, label = "Cookie", id = f"c{k}")
+        g.add_edges_from([(2, 0), (2, 10), (3, 10), (4, 1), (4, 11), (5, 11)])
+        g.add_edges_from((5, 12 + k) for k in range(20))
+        reports = []
+        add_hook(reports.append)
+        try:
+            best, _ = infer_identities(g, max_predictions = 1)
+        finally:
+            remove_hook(reports.append)
+        assert best == [(3, 0, 0.5)]
+        assert reports[0]["counters"]["components"] == 1 and reports[0]["counters"]["skipped components"] == 1
+        assert len(top) == min(10, len(everything))
+        assert [p for u, v, p in top] == sorted([p for u, v, p in everything], reverse = True)[:len(top)]
+
+        # the bound of 2/21 rounds to the threshold like the coupling itself
+        g = nx.DiGraph()
+        g.add_node(0, label = "Identity", id = "i")
+        g.add_node(1, label = "Device", id = "d1")
+        g.add_node(2, label = "Device", id = "d2")
+        g.add_edge(1, 0)
+        for k in range(20):
+            g.add_node(10 + k, label = "Cookie", id = f"c{k}")
+            g.add_edge(1, 10 + k)
+        g.add_edges_from([(2, 10), (2, 11)])
+        assert infer_identities(g, max_predictions = None)[0] == [(2, 0, 0.1)]
+        assert infer_identities(g, max_predictions = 10)[0] == [(2, 0, 0.1)]
+        assert infer_identities(g, max_predictions = None, engine = "minhash", num_perm = 128, bands = 128)[0] == [(2, 0, 0.1)]
+        assert infer_identities(g, max_predictions = None, engine = "sparse")[0] == [(2, 0, 0.1)]
+        shard = {"components": [g.to_undirected()], "threshold": 0.1, "max_predictions": 10, "max_hops": None, "weights": None, "kernel": None}
+        assert infer_shard(shard) == [(2, 0, 0.1)]
+
+    def test_parallel_inference(self):
+        g = create_synthetic_graph(300, 100)
+        expected, _ = infer_identities(g, max_predictions = 10000)
+        inferred, _ = infer_identities(g, max_predictions = 10000, workers = 2)
+        assert sorted(inferred) == sorted(expected)
+
+        # the largest components go first and the workers skip the ones below the top-N floor
+        g = create_synthetic_graph(600, 200, 0.5, 0.5, 0.5)
+        reports = []
+        add_hook(reports.append)
+        set_quiet(True)
+        try:
+            expected, _ = infer_identities(g, max_predictions = 5)
+            inferred, _ = infer_identities(g, max_predictions = 5, workers = 2)
+        finally:
+            set_quiet(False)
+            remove_hook(reports.append)
+        assert [p for u, v, p in inferred] == [p for u, v, p in expected]
+        sizes = [c["size"] for c in reports[1]["components"]]
+        assert sizes == sorted(sizes, reverse = True)
+        assert reports[1]["counters"]["skipped components"] > 0
+
+    def test_incremental_resolver(self):
+        entities = graph_to_entities_json(create_synthetic_graph(300, 100, 0.5, 0.5, 0.5))
+        resolver = IncrementalResolver()
+        resolver.add_entities(entities[:len(entities) // 2])
+        delta = resolver.add_entities(entities[len(entities) // 2:])
+        assert len(delta["added"]) + len(delta["changed"]) > 0
+        _, expected = infer_identities(entities_json_to_graph(entities), return_ids = True, max_predictions = None)
+        assert sorted(resolver.get_predictions()) == sorted(expected)
+
+    def test_most_probable_couplings(self):
+        h = nx.Graph()
+        h.add_edge("i", "a")
+        h.add_edge("a", "b", p = 0.2)
+        h.add_edge("a", "c", p = 0.9)
+        h.add_edge("c", "b", p = 0.9)
+        found = most_probable_couplings(get_weighted_neighbors(h), "i", 0.1)
+        assert round(found["b"][0], 2) == 0.81
+        assert found["b"][1] == 3
+        assert found["b"][2] == "c"
+        found = most_probable_couplings(get_weighted_neighbors(h), "i", 0.1, max_hops = 2)
+        assert round(found["b"][0], 2) == 0.2
+        found = most_probable_couplings(get_weighted_neighbors(h), "i", 0.85)
+        assert "b" not in found and "c" in found
+        # the most probable path to c is too long to go on to d, the direct one is not
+        h = nx.Graph()
+        h.add_edge("i", "a")
+        h.add_edge("a", "b", p = 0.9)
+        h.add_edge("b", "c", p = 0.9)
+        h.add_edge("a", "c", p = 0.5)
+        h.add_edge("c", "d", p = 0.9)
+        found = most_probable_couplings(get_weighted_neighbors(h), "i", 0.1, max_hops = 3)
+        assert round(found["c"][0], 2) == 0.81 and found["c"][1] == 3
+        assert round(found["d"][0], 2) == 0.45 and found["d"][1] == 3
+
+    def test_minhash_engine(self):
+        g = get_sample_graph()
+        expected, _ = infer_identities(g)
+        # a single row per band finds every couple sharing an attribute
+        inferred, _ = infer_identities(g, engine = "minhash", num_perm = 64, bands = 64)
+        assert sorted(inferred) == sorted(expected)
+
+    def test_supernodes(self):
+        g = nx.DiGraph()
+        g.add_node(0, label = "Identity", id = "i")
+        g.add_node(1, label = "IP", id = "ip")
+        g.add_node(2, label = "Cookie", id = "c")
+        for u in range(3, 7):
+            g.add_node(u, label = "Device", id = str(u))
+            g.add_edge(u, 1, label = "HAS_IP")
+        g.add_edge(3, 0, label = "HAS_IDENTITY")
+        g.add_edge(3, 2, label = "HAS_COOKIE")
+        g.add_edge(4, 2, label = "HAS_COOKIE")
+        inferred, _ = infer_identities(g)
+        assert len(inferred) == 3
+        for engine in ["networkx", "sparse"]:
+            inferred, _ = infer_identities(g, engine = engine, max_degree = 3)
+            assert inferred == [(4, 0, 0.5)]
+            inferred, _ = infer_identities(g, engine = engine, max_degree = {"IP": 3}, supernode_strategy = "downweight")
+            assert inferred == [(4, 0, 0.64)]
+
+    def test_similarity_kernels(self):
+        a = sp.csr_matrix(np.array([[1, 1, 0], [1, 0, 1], [1, 0, 0]]))
+        rows, cols = np.array([0, 0]), np.array([1, 2])
+        assert np.allclose(jaccard_kernel(a, rows, cols), [1 / 3, 1 / 2])
+        # the shared attribute has three devices, the others one
+        assert np.allclose(resource_allocation_kernel(a, rows, cols), [(1 / 3) / (1 / 3 + 2), (1 / 3) / (1 / 3 + 1)])
+        assert np.allclose(get_kernel({"IP": 2.0})(a, rows, cols, labels = ["IP", "Location", "Cookie"]), [2 / 4, 2 / 3])
+        g = get_sample_graph()
+        expected, _ = infer_identities(g)
+        inferred, _ = infer_identities(g, similarity = {})
+        assert sorted(inferred) == sorted(expected)
+        for similarity in ["adamic_adar", "resource_allocation"]:
+            inferred, _ = infer_identities(g, similarity = similarity)
+            sparse, _ = infer_identities(g, engine = "sparse", similarity = similarity)
+            assert sorted(inferred) == sorted(sparse)
+
+    def test_component_cache(self):
+        g = get_sample_graph()
+        expected, _ = infer_identities(g)
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ComponentCache(directory)
+            inferred, _ = infer_identities(g, cache = cache)
+            assert sorted(inferred) == sorted(expected) and cache.hits == 0
+            # a renumbered copy of the graph has the same fingerprints
+            h = nx.relabel_nodes(g, {u: u + 100 for u in g.nodes()})
+            inferred, _ = infer_identities(h, cache = cache)
+            assert sorted(inferred) == sorted((u + 100, v + 100, p) for u, v, p in expected)
+            assert cache.hits > 0 and cache.misses == 1
+            infer_identities(g, threshold = 0.2, cache = cache)
+            assert cache.misses == 2
+
+    def test_checkpoint_resume(self):
+        g = create_synthetic_graph(300, 60)
+        expected, _ = infer_identities(g, max_predictions = 20)
+        with tempfile.TemporaryDirectory() as directory:
+            infer_identities(g, max_predictions = 20, work_directory = directory)
+            assert os.path.exists(os.path.join(directory, Checkpoint.progress_file))
+            inferred, _ = infer_identities(g, max_predictions = 20, resume_from = directory)
+            assert sorted(inferred) == sorted(expected)
+            with self.assertRaises(Exception):
+                infer_identities(g, threshold = 0.3, resume_from = directory)
+
+    def test_candidate_table(self):
+        g = create_synthetic_graph(300, 60)
+        table = build_candidate_table(g, floor = 0.05)
+        for threshold, max_predictions in [(0.1, None), (0.3, 10)]:
+            expected, _ = infer_identities(g, threshold, max_predictions = max_predictions)
+            found = table.above(threshold).top(max_predictions).to_predictions()
+            assert sorted(p for u, v, p in found) == sorted(p for u, v, p in expected)
+        best = table.per_identity(1)
+        assert len(set(best.identities)) == len(best)
+        assert all(len(table.attributes(k)) > 0 for k in range(len(table)) if table.hops[k] >= 2)
+
+    def test_instrumentation(self):
+        reports = []
+        add_hook(reports.append)
+        set_quiet(True)
+        try:
+            infer_identities(create_synthetic_graph(300, 60))
+        finally:
+            set_quiet(False)
+            remove_hook(reports.append)
+        assert len(reports) == 1 and reports[0] == get_report()
+        assert {"component split", "pair generation", "similarity", "path search", "output"} <= set(reports[0]["spans"])
+        assert reports[0]["counters"]["components"] == len(reports[0]["components"])
+
+    def test_benchmarks(self):
+        set_quiet()
+        try:
+            report = run_benchmarks((200, 400), trace_memory = True, lines_per_file = 100)
+        finally:
+            set_quiet(False)
+        assert sorted((r["devices"], r["step"]) for r in report["results"]) == sorted((devices, step) for devices in (200, 400) for step in pipeline_steps)
+        for r in report["results"]:
+            assert {"seconds", "max_rss_bytes", "peak_traced_bytes"} <= set(r)
+            assert r["seconds"] >= 0 and r["peak_traced_bytes"] > 0
+        assert all(r["predictions"] >= 0 for r in report["results"] if r["step"] in ["infer_identities", "infer_jaccard_identity"])
+        assert compare_benchmarks(report, report) == []
+        # the tracing stops even when the step fails
+        with self.assertRaises(ZeroDivisionError):
+            measure("failing", 0, True, lambda: 1 / 0)
+        assert not tracemalloc.is_tracing()
+        # the timed call runs without tracing, the traced one comes after it
+        tracing = []
+        result, record = measure("step", 0, True, lambda: tracing.append(tracemalloc.is_tracing()) or 1)
+        assert result == 1 and tracing == [False, True] and "peak_traced_bytes" in record
+
+    def test_evaluation(self):
+        g = create_synthetic_graph(300, 60, seed = 1, identity_affinity = 0.8)
+        inferred, _ = infer_identities(g, max_predictions = None)
+        scores = evaluate_predictions(g, inferred)
+        assert scores["predictions"] == len(inferred)
+        assert 0 < scores["precision"] <= 1 and 0 < scores["recall"] <= 1
+        frame = evaluate_variants(g, {"networkx": {}, "sparse": {"engine": "sparse"}}, trace_memory = False)
+        assert list(frame["f1"]) == [scores["f1"], scores["f1"]]
+        assert len(pareto_front(frame)) == 1
+
+    def test_out_of_core(self):
+        set_quiet()
+        g = create_synthetic_graph(300, 60, seed = 2)
+        with tempfile.TemporaryDirectory() as raw_directory:
+            graph_to_raw(g, raw_directory, 200)
+            m = raw_to_graph(raw_directory)
+            inferred, _ = infer_identities(m, max_predictions = None)
+            expected = sorted((m.nodes[u]["id"], m.nodes[v]["id"], p) for u, v, p in inferred)
+            # a small chunk size spreads the components over many buckets and merges the node partitions from sorted runs
+            found = infer_out_of_core(raw_directory, max_predictions = None, chunk_size = 50)
+            assert sorted(found) == expected
+            top = infer_out_of_core(raw_directory, max_predictions = 5)
+            assert [p for u, v, p in top] == [p for u, v, p in infer_identities(m, max_predictions = 5)[0]]
+        set_quiet(False)
+
+    def test_sharded_inference(self):
+        set_quiet()
+        g = create_synthetic_graph(300, 60, seed = 2)
+        inferred, _ = infer_identities(g, max_predictions = None)
+        assert sorted(infer_sharded_identities(g, max_predictions = None, shards = 4, workers = 2)) == sorted(inferred)
+        with tempfile.TemporaryDirectory() as shard_directory:
+            names = write_shards(g, shard_directory, 4, max_predictions = None)
+            # a worker claims a shard and dies
+            pending = os.path.join(shard_directory, "pending")
+            os.rename(os.path.join(pending, names[0]), os.path.join(shard_directory, "claimed", names[0] + ".lost"))
+            assert run_worker(shard_directory) == len(names) - 1
+            assert release_stale_claims(shard_directory) == 1
+            assert run_worker(shard_directory) == 1
+            assert sorted(merge_shards(shard_directory, names, None)) == sorted(inferred)
+        with tempfile.TemporaryDirectory() as shard_directory:
+            names = write_shards(g, shard_directory, 4, max_predictions = None)
+            # a remote worker is busy with a shard while the local workers are already gone
+            remote = os.path.join(shard_directory, "claimed", names[0] + ".remote-1")
+            os.rename(os.path.join(shard_directory, "pending", names[0]), remote)
+            dead = multiprocessing.Process(target = len, args = ([],))
+            dead.start()
+            dead.join()
+
+            kept = []
+
+            def finish():
+                time.sleep(0.3)
+                kept.append(os.path.exists(remote))
+                with open(os.path.join(shard_directory, "done", names[0]), "wb") as f:
+                    pickle.dump(infer_shard(pickle.load(open(remote, "rb"))), f)
+                os.remove(remote)
+
+            worker = threading.Thread(target = finish)
+            worker.start()
+            wait_for_shards(shard_directory, names, [dead], poll_interval = 0.05)
+            worker.join()
+            assert kept == [True]
+            assert sorted(merge_shards(shard_directory, names, None)) == sorted(inferred)
+        with tempfile.TemporaryDirectory() as shard_directory:
+            # a reused directory does not hand back the predictions of the previous graph
+            assert sorted(infer_sharded_identities(g, max_predictions = None, shards = 4, workers = 1, shard_directory = shard_directory)) == sorted(inferred)
+            h = create_synthetic_graph(300, 60, seed = 3)
+            expected, _ = infer_identities(h, max_predictions = None)
+            os.remove(os.path.join(shard_directory, "closed"))
+            worker = threading.Thread(target = run_worker, args = (shard_directory, 0.05))
+            worker.start()
+            found = infer_sharded_identities(h, max_predictions = None, shards = 4, workers = 0, shard_directory = shard_directory, poll_interval = 0.05)
+            worker.join()
+            assert sorted(found) == sorted(expected)
+        set_quiet(False)
+
+    def test_point_queries(self):
+        g = create_synthetic_graph(300, 60, seed = 4)
+        inferred, ids = infer_identities(g, return_ids = True, max_predictions = None)
+        for device, identity, p in ids[:20]:
+            assert (identity, p) in resolve_device(g, device)
+            assert (device, p) in resolve_identity(g, str.upper(identity))
+        devices = [g.nodes[u]["id"] for u in g.nodes() if g.nodes[u]["label"] == "Device"]
+        assert sum(len(resolve_device(g, id)) for id in devices) == len(ids)
+        with self.assertRaises(Exception):
+            resolve_device(g, "unknown")
+
+    def test_prediction_index(self):
+        g = create_synthetic_graph(300, 60, seed = 4)
+        inferred, ids = infer_identities(g, return_ids = True, max_predictions = None)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "predictions.idx")
+            write_prediction_index(ids, path)
+            index = PredictionIndex(path)
+            assert len(index) == len({d for d, i, p in ids})
+            for device, identity, p in ids:
+                assert (identity, p) in index.lookup(str.upper(device))
+            assert index.lookup("unknown") == []
+            assert not index.refresh()
+            # a new build replaces the file while the index is open
+            write_prediction_index([(ids[0][0], "new", 0.5)], path)
+            assert (ids[0][1], ids[0][2]) in index.lookup(ids[0][0])
+            assert index.refresh()
+            assert index.lookup(ids[0][0]) == [("new", 0.5)] and len(index) == 1
+            index.close()
+
+    def test_resolution_service(self):
+        service = ResolutionService()
+        delta = service.ingest([{"Device": "a", "Cookie": "c1", "Identity": "x"}, {"Device": "b", "Cookie": "c1"}])
+        assert delta["added"] == [("b", "x", 0.5)]
+        assert service.resolve_device("b") == {"device": "b", "known": [], "inferred": [["x", 0.5]]}
+        assert service.resolve_identity("X") == {"identity": "x", "known": ["a"], "inferred": [["b", 0.5]]}
+
+        async def exchange():
+            server = await service.start("127.0.0.1", 0)
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            answers = []
+            for request in [b"GET /resolve/device/b HTTP/1.1\r\n\r\n", b"GET /resolve/device/unknown HTTP/1.1\r\n\r\n",
+                            b'POST /ingest HTTP/1.1\r\nContent-Length: 36\r\n\r\n[{"Device": "b", "Identity": "x"}]  ',
+                            b"GET /stats HTTP/1.1\r\nConnection: close\r\n\r\n"]:
+                writer.write(request)
+                status = int((await reader.readline()).split()[1])
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line == b"\r\n":
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.lower()] = value.strip()
+                answers.append((status, json.loads(await reader.readexactly(int(headers["content-length"])))))
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return answers
+
+        answers = asyncio.run(exchange())
+        assert answers[0] == (200, {"device": "b", "known": [], "inferred": [["x", 0.5]]})
+        assert answers[1][0] == 404
+        assert answers[2] == (200, {"added": 0, "changed": 0, "removed": 1})
+        assert service.resolve_device("b")["known"] == ["x"]
+        assert answers[3][1]["endpoints"]["resolve device"]["requests"] == 2
+
+        # a malformed batch is refused as a whole
+        service = ResolutionService()
+        assert service.handle("POST", "/ingest", b'[{"Device": "b", "Cookie": "c1"}, 5]')[1] == 400
+        assert service.handle("POST", "/ingest", b'{"Device": {"id": "b"}}')[1] == 400
+        assert service.resolve_device("b") is None
+        service.ingest([{"Device": "a", "Cookie": "c1", "Identity": "x"}])
+        with self.assertRaises(ValueError):
+            service.ingest([{"Device": "b", "Cookie": "c1"}, 5])
+        # the records before the bad one are kept with fresh predictions
+        assert service.resolve_device("b")["inferred"] == [["x", 0.5]]
+
 
 if __name__ == '__main__':
     unittest.main()